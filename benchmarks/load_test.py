@@ -0,0 +1,111 @@
+import sys
+sys.path.append('.')
+import json
+import time
+import asyncio
+import argparse
+from urllib.parse import urlencode
+
+import numpy as np
+
+"""
+Load test for scripts/query_service.py. --concurrency clients, each on its own
+keep-alive connection, send requests taken in turn from a mix over every
+endpoint until --requests have been answered, and report p50/p99 latency and
+throughput, overall and per endpoint:
+
+	python scripts/query_service.py --workers 2 &
+	python benchmarks/load_test.py --concurrency 16 --requests 2000
+
+The first --warmup requests are not counted, so the workers' first-use
+builds (event counts, skipgram indexes, ...) are left out of the figures.
+"""
+
+QUERY_MIX = [
+	('surprise', {'n': 3, 'k': 20}, None),
+	('surprise', {'n': 4, 'k': 20}, None),
+	('collocates', {'mask': '11x11', 'term': 'the'}, None),
+	('collocates', {'mask': '110x011', 'term': 'people'}, None),
+	('event_rates', {'event': 'laughter', 'n': 2, 'count_threshold': 5}, None),
+	('event_rates', {'event': 'applause', 'n': 3, 'count_threshold': 5}, None),
+	('skipgram_fillers', {'skipgram': 'the ____ of'}, None),
+	('skipgram_fillers', {'skipgram': 'i ____ ____ that'}, None),
+	('score', {}, {'lines': ['thank you so much', 'and that is the thing about the world', 'we are going to change'], 'n': 3}),
+]
+
+async def send(reader, writer, host, endpoint, params, body):
+	"""(status, seconds) of one request over an open connection"""
+	target = '/{}?{}'.format(endpoint, urlencode(params))
+	data = json.dumps(body).encode() if body is not None else b''
+	head = '{} {} HTTP/1.1\r\nHost: {}\r\nContent-Length: {}\r\n\r\n'.format('POST' if body is not None else 'GET',
+			target, host, len(data))
+	start = time.perf_counter()
+	writer.write(head.encode('latin-1') + data)
+	await writer.drain()
+	status = int((await reader.readline()).split()[1])
+	length = 0
+	while True:
+		line = await reader.readline()
+		if not line.strip():
+			break
+		name, value = line.decode('latin-1').split(':', 1)
+		if name.strip().lower() == 'content-length':
+			length = int(value)
+	await reader.readexactly(length)
+	return status, time.perf_counter() - start
+
+async def client(args, next_request, latencies, errors):
+	reader, writer = await asyncio.open_connection(args.host, args.port)
+	try:
+		while True:
+			i = next_request()
+			if i is None:
+				break
+			endpoint, params, body = QUERY_MIX[i % len(QUERY_MIX)]
+			status, seconds = await send(reader, writer, args.host, endpoint, params, body)
+			if i >= args.warmup:
+				latencies.setdefault(endpoint, []).append(seconds)
+				if status != 200:
+					errors[endpoint] = errors.get(endpoint, 0) + 1
+	finally:
+		writer.close()
+
+async def run_load_test(args):
+	"""{endpoint: latencies in seconds}, {endpoint: non-200 responses}, wall seconds of the counted requests"""
+	latencies, errors = {}, {}
+	warmup = iter(range(args.warmup))
+	await asyncio.gather(*[client(args, lambda: next(warmup, None), latencies, errors) for __ in range(args.concurrency)])
+	counted = iter(range(args.warmup, args.warmup + args.requests))
+	start = time.perf_counter()
+	await asyncio.gather(*[client(args, lambda: next(counted, None), latencies, errors) for __ in range(args.concurrency)])
+	return latencies, errors, time.perf_counter() - start
+
+def summarize(latencies, errors, seconds):
+	rows = {}
+	for endpoint, values in list(latencies.items()) + [('all', [v for values in latencies.values() for v in values])]:
+		values = np.array(values) * 1000
+		rows[endpoint] = {'requests': len(values), 'errors': errors.get(endpoint, 0) if endpoint != 'all' else sum(errors.values()),
+							'p50_ms': round(float(np.percentile(values, 50)), 2), 'p99_ms': round(float(np.percentile(values, 99)), 2),
+							'requests_per_s': round(len(values) / seconds, 1)}
+	return rows
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Measure the latency of scripts/query_service.py under concurrent load.')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8350)
+	parser.add_argument('--concurrency', type=int, default=8)
+	parser.add_argument('--requests', type=int, default=1000)
+	parser.add_argument('--warmup', type=int, default=2 * len(QUERY_MIX))
+	parser.add_argument('--output', help='also write the summary as JSON')
+	args = parser.parse_args()
+
+	latencies, errors, seconds = asyncio.run(run_load_test(args))
+	rows = summarize(latencies, errors, seconds)
+	print('{} requests at concurrency {} in {:.2f} s'.format(args.requests, args.concurrency, seconds))
+	print('{:<20}{:>10}{:>8}{:>12}{:>12}{:>10}'.format('endpoint', 'requests', 'errors', 'p50 ms', 'p99 ms', 'req/s'))
+	for endpoint, row in rows.items():
+		print('{:<20}{:>10}{:>8}{:>12.2f}{:>12.2f}{:>10.1f}'.format(endpoint, row['requests'], row['errors'],
+																	row['p50_ms'], row['p99_ms'], row['requests_per_s']))
+	if args.output:
+		with open(args.output, 'w') as f:
+			json.dump({'params': vars(args), 'seconds': seconds, 'results': rows}, f, indent=2)
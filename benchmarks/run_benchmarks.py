@@ -0,0 +1,140 @@
+import sys
+sys.path.append('.')
+import io
+import os
+import gc
+import json
+import time
+import argparse
+import platform
+import contextlib
+import subprocess
+import tracemalloc
+
+import numpy as np
+
+from utilities import librarian, instrumentation
+from utilities.corpus_store import read_columnar_corpus
+from utilities.ngram_utils import tf_idf
+from models.ngram_model import NgramModel
+from models.skipgrams import build_skipgram_tree
+from benchmarks.synthetic_corpus import write_corpus
+
+"""
+Times the main analyses on a synthetic corpus and writes the results as JSON,
+one file per commit, so runs can be compared across commits:
+
+	python benchmarks/run_benchmarks.py --talks 1000
+	python benchmarks/run_benchmarks.py --talks 1000 --compare benchmarks/results/<older commit>.json
+
+Each benchmark reports the best wall time over --repeat runs and the peak
+memory traced by tracemalloc during one further run. load_dataframe reads the
+columnar corpus, converted from the CSVs on first use; read_csv_dataframe
+times the CSV path it replaces. --stages adds the
+per-stage spans of one instrumented model build (see utilities/instrumentation.py).
+"""
+
+COLLOCATE_MASK = [True, True, 'X', True, True]
+SKIPGRAM_MASK = [True, False, True]
+
+def measure(func, repeat):
+	"""(best wall seconds, peak traced MB, result of the last run), with func's printing silenced"""
+	times = []
+	with contextlib.redirect_stdout(io.StringIO()):
+		for __ in range(repeat):
+			gc.collect()
+			start = time.perf_counter()
+			result = func()
+			times.append(time.perf_counter() - start)
+		del result
+		gc.collect()
+		tracemalloc.start()
+		result = func()
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	return min(times), peak / 1e6, result
+
+def run_benchmarks(args):
+	results = {}
+
+	def run(name, func):
+		seconds, peak_mb, result = measure(func, args.repeat)
+		results[name] = {'seconds': round(seconds, 4), 'peak_mb': round(peak_mb, 2)}
+		print('{:<40}{:>10.3f} s{:>10.1f} MB'.format(name, seconds, peak_mb))
+		return result
+
+	run('read_csv_dataframe', lambda: librarian.read_csv_dataframe(truncate=args.talks))
+	df = run('load_dataframe', lambda: librarian.load_dataframe(truncate=args.talks))
+	run('load_dataframe_lines_tags', lambda: librarian.load_dataframe(truncate=args.talks, columns=['lines', 'tags']))
+	model = run('NgramModel', lambda: NgramModel(df, args.max_ng_size).materialize())
+	# stream_talks follows transcripts.csv, not load_dataframe's ted_main.csv order; the synthetic CSVs list the same talks in the same order
+	run('NgramModel_from_talks', lambda: NgramModel.from_talks(librarian.stream_talks(args.talks, tokens_only=True), args.max_ng_size).materialize())
+	run('NgramModel_lazy_surprise', lambda: NgramModel(df, args.max_ng_size).top_ngrams_by_surprise(3, 3, 5))
+	run('tf_idf', lambda: tf_idf(df['lines'], 2))
+	run('ngrams_by_unigram_and_bigram_surprise', lambda: model.ngrams_by_unigram_and_bigram_surprise(3, 3, 5))
+	run('build_collocates_from_mask', lambda: model.build_collocates_from_mask(COLLOCATE_MASK, 10))
+	run('build_skipgram_tree', lambda: build_skipgram_tree(SKIPGRAM_MASK, model.lines))
+	return results
+
+def build_stages(df, args):
+	"""span report of one model build, with memory peaks and, given --profile-dir, cProfile dumps"""
+	instrumentation.enable(trace_memory=True, profile_dir=args.profile_dir)
+	try:
+		with instrumentation.span('build'):
+			NgramModel(df, args.max_ng_size).materialize()
+		print('\n' + instrumentation.format_report())
+		return instrumentation.report()
+	finally:
+		instrumentation.disable()
+
+def current_commit():
+	try:
+		return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return 'unknown'
+
+def compare(results, baseline_path):
+	"""print each benchmark's time and memory as a ratio of a baseline run's"""
+	with open(baseline_path) as f:
+		baseline = json.load(f)
+	print('\nvs {} ({})'.format(baseline['commit'], baseline_path))
+	for name, result in results.items():
+		if name in baseline['results']:
+			old = baseline['results'][name]
+			print('{:<40}{:>9.2f}x time{:>9.2f}x memory'.format(name, result['seconds'] / max(old['seconds'], 1e-9),
+																result['peak_mb'] / max(old['peak_mb'], 1e-9)))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the corpus pipeline on synthetic data.')
+	parser.add_argument('--talks', type=int, default=500)
+	parser.add_argument('--words-per-talk', type=int, default=2000)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--max-ng-size', type=int, default=4)
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--data-dir', help='where the synthetic CSVs are written (default: benchmarks/data/<size>)')
+	parser.add_argument('--output', help='results JSON (default: benchmarks/results/<commit>.json)')
+	parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+	parser.add_argument('--stages', action='store_true', help='also record the per-stage spans of one model build')
+	parser.add_argument('--profile-dir', help='with --stages, write a cProfile dump of the build here')
+	args = parser.parse_args()
+
+	data_dir = args.data_dir or os.path.join('benchmarks', 'data', '{}x{}_seed{}'.format(args.talks, args.words_per_talk, args.seed))
+	librarian.TED_MAIN_PATH = os.path.join(data_dir, 'ted_main.csv')
+	librarian.TRANSCRIPTS_PATH = os.path.join(data_dir, 'transcripts.csv')
+	if not (os.path.exists(librarian.TED_MAIN_PATH) and os.path.exists(librarian.TRANSCRIPTS_PATH)):
+		write_corpus(data_dir, args.talks, args.words_per_talk, seed=args.seed)
+	librarian.CORPUS_PATH = os.path.join(data_dir, 'corpus')
+	if read_columnar_corpus(librarian.CORPUS_PATH, ['url'], 0, librarian.corpus_source()) is None:
+		librarian.convert_corpus()
+
+	commit = current_commit()
+	results = run_benchmarks(args)
+	stages = build_stages(librarian.load_dataframe(truncate=args.talks), args) if args.stages else None
+	output = args.output or os.path.join('benchmarks', 'results', commit + '.json')
+	os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+	with open(output, 'w') as f:
+		json.dump({'commit': commit, 'python': platform.python_version(), 'numpy': np.__version__,
+					'params': vars(args), 'results': results, 'stages': stages}, f, indent=2)
+	print('\nwrote ' + output)
+	if args.compare:
+		compare(results, args.compare)
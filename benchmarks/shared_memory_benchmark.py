@@ -0,0 +1,118 @@
+import sys
+sys.path.append('.')
+import os
+import time
+import shutil
+import argparse
+import multiprocessing
+
+from utilities import librarian
+from utilities.corpus_store import read_columnar_corpus
+from models.ngram_model import NgramModel
+from models.shared_model import export_model, SharedNgramModel
+from benchmarks.synthetic_corpus import write_corpus
+
+"""
+Memory of N worker processes each holding the same model, three ways:
+
+- rebuild: every worker loads the corpus and builds its own model
+- snapshot: every worker opens one saved snapshot (memory-mapped)
+- shared: every worker attaches to one export in shared memory
+
+	python benchmarks/shared_memory_benchmark.py --talks 1000 --workers 4
+
+Workers are spawned, so they inherit nothing from this process. Each runs the
+same queries (surprise, TF-IDF top k, scoring) and, while all of them are
+alive, reads its proportional set size (PSS: private pages plus an even share
+of the pages it shares) and unique set size (USS: private pages only) from
+/proc/self/smaps_rollup, so the workers' PSS add up to what they cost together.
+Every mode must give the same query results.
+"""
+
+def memory_mb():
+	"""(PSS, USS) of this process in MB"""
+	fields = {}
+	with open('/proc/self/smaps_rollup') as f:
+		for line in f:
+			parts = line.split()
+			if len(parts) == 3 and parts[2] == 'kB':
+				fields[parts[0].rstrip(':')] = int(parts[1])
+	return fields['Pss'] / 1e3, (fields['Private_Clean'] + fields['Private_Dirty']) / 1e3
+
+def open_model(mode, source, args):
+	if mode == 'rebuild':
+		librarian.TED_MAIN_PATH, librarian.TRANSCRIPTS_PATH, librarian.CORPUS_PATH = source
+		return NgramModel(librarian.load_dataframe(truncate=args.talks), args.max_ng_size)
+	if mode == 'snapshot':
+		return NgramModel.load(source)
+	return SharedNgramModel.attach(source)
+
+def run_queries(model):
+	results = [model.top_ngrams_by_surprise(n, 3, 5, 20) for n in range(1, model.max_ng_size+1)]
+	results += [model.tfidf_matrices[n-1].top_k(10)[2].tolist() for n in range(1, model.max_ng_size+1)]
+	results.append(model.score_lines(['thank you so much', 'and that is the thing about the world'])[0].tolist())
+	return results
+
+def worker(mode, source, args, barrier, output):
+	start = time.perf_counter()
+	model = open_model(mode, source, args)
+	results = run_queries(model)
+	seconds = time.perf_counter() - start
+	barrier.wait()		# measure while every worker is alive, so shared pages are split between all of them
+	pss, uss = memory_mb()
+	output.put((seconds, pss, uss, results))
+	barrier.wait()
+
+def run_mode(mode, source, args):
+	"""(seconds, PSS MB, USS MB) of each worker, and the query results they all gave"""
+	context = multiprocessing.get_context('spawn')
+	barrier, output = context.Barrier(args.workers), context.Queue()
+	workers = [context.Process(target=worker, args=(mode, source, args, barrier, output)) for __ in range(args.workers)]
+	for process in workers:
+		process.start()
+	measurements = [output.get() for __ in workers]
+	for process in workers:
+		process.join()
+	results = [measurement[3] for measurement in measurements]
+	assert all(result == results[0] for result in results)
+	return [measurement[:3] for measurement in measurements], results[0]
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare the memory of workers rebuilding, memory-mapping or attaching to one model.')
+	parser.add_argument('--talks', type=int, default=500)
+	parser.add_argument('--words-per-talk', type=int, default=2000)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--max-ng-size', type=int, default=4)
+	parser.add_argument('--workers', type=int, default=4)
+	parser.add_argument('--data-dir', help='where the synthetic CSVs are written (default: benchmarks/data/<size>)')
+	args = parser.parse_args()
+
+	data_dir = args.data_dir or os.path.join('benchmarks', 'data', '{}x{}_seed{}'.format(args.talks, args.words_per_talk, args.seed))
+	librarian.TED_MAIN_PATH = os.path.join(data_dir, 'ted_main.csv')
+	librarian.TRANSCRIPTS_PATH = os.path.join(data_dir, 'transcripts.csv')
+	librarian.CORPUS_PATH = os.path.join(data_dir, 'corpus')
+	if not (os.path.exists(librarian.TED_MAIN_PATH) and os.path.exists(librarian.TRANSCRIPTS_PATH)):
+		write_corpus(data_dir, args.talks, args.words_per_talk, seed=args.seed)
+	if read_columnar_corpus(librarian.CORPUS_PATH, ['url'], 0, librarian.corpus_source()) is None:
+		librarian.convert_corpus()
+
+	model = NgramModel(librarian.load_dataframe(truncate=args.talks), args.max_ng_size)
+	snapshot_path = os.path.join(data_dir, 'shared_memory_benchmark_snapshot')
+	shutil.rmtree(snapshot_path, ignore_errors=True)
+	model.save(snapshot_path)
+	print('{} workers, {} talks, model of order {}'.format(args.workers, args.talks, args.max_ng_size))
+	print('{:<12}{:>14}{:>16}{:>16}'.format('mode', 'open+query s', 'PSS MB (sum)', 'USS MB (each)'))
+	expected = None
+	try:
+		with export_model(model) as export:
+			sources = {'rebuild': (librarian.TED_MAIN_PATH, librarian.TRANSCRIPTS_PATH, librarian.CORPUS_PATH),
+						'snapshot': snapshot_path, 'shared': export.handle}
+			for mode, source in sources.items():
+				measurements, results = run_mode(mode, source, args)
+				assert expected is None or results == expected, mode
+				expected = results
+				seconds, pss, uss = zip(*measurements)
+				print('{:<12}{:>14.2f}{:>16.1f}{:>16.1f}'.format(mode, max(seconds), sum(pss), sum(uss) / len(uss)))
+			print('shared memory block: {:.1f} MB'.format(export.size / 1e6))
+	finally:
+		shutil.rmtree(snapshot_path, ignore_errors=True)
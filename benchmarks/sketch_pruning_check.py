@@ -0,0 +1,72 @@
+import sys
+sys.path.append('.')
+import time
+import argparse
+
+import numpy as np
+
+from models.sketches import HeavyHitterCounting, count_heavy_ngram_order, hash_rows
+from utilities.ngram_utils import count_ngram_order, count_windows, window_starts, ngram_id_rows, row_keys
+
+"""
+Checks that heavy-hitter counting actually prunes at the size of the full
+corpus (about 5M tokens) and stays exact for what it keeps:
+
+	python benchmarks/sketch_pruning_check.py --tokens 5000000
+
+For each high order it fills a sketch as NgramModel does, then reports the share
+of windows of rare ngrams (fewer than min_count occurrences) whose estimate still
+reaches min_count, so would be counted exactly in the second pass. It asserts
+that share stays under --max-survival, that no frequent ngram is pruned, and that
+the kept ngrams' counts equal the exact ones. Tokens are drawn from a Zipf
+distribution, which leaves almost every high-order ngram unique.
+"""
+
+def zipf_corpus(rng, num_tokens, vocab_size, words_per_doc=2000):
+	"""(stream, line_bounds, doc_bounds) of lines of 3 to 18 tokens"""
+	weights = 1. / np.arange(1, vocab_size + 1)
+	stream = rng.choice(vocab_size, size=num_tokens, p=weights / weights.sum()).astype(np.int32)
+	line_bounds = np.concatenate([[0], np.cumsum(rng.integers(3, 19, size=num_tokens // 3))])
+	line_bounds = np.append(line_bounds[line_bounds < num_tokens], num_tokens)
+	lines_per_doc = max(int(len(line_bounds) * words_per_doc / num_tokens), 1)
+	doc_bounds = np.append(np.arange(0, len(line_bounds) - 1, lines_per_doc), len(line_bounds) - 1)
+	return stream, line_bounds, doc_bounds
+
+def check_order(stream, line_bounds, doc_bounds, n, approximate):
+	"""(windows, share of rare ngrams' windows surviving the sketch, sketch MB, seconds)"""
+	sketch = approximate.new_sketch(count_windows(line_bounds, n))
+	start = time.perf_counter()
+	heavy = count_heavy_ngram_order(stream, line_bounds, doc_bounds, n, sketch, approximate.min_count)
+	seconds = time.perf_counter() - start
+	exact = count_ngram_order(stream, line_bounds, doc_bounds, n)
+
+	rows = ngram_id_rows(stream, window_starts(line_bounds, n), n)
+	__, inverse, counts = np.unique(row_keys(rows), return_inverse=True, return_counts=True)
+	rare = counts[inverse.ravel()] < approximate.min_count
+	survives = sketch.estimate(hash_rows(rows)) >= approximate.min_count
+	assert survives[~rare].all(), 'a frequent ngram was pruned'
+
+	frequent = exact.counts >= approximate.min_count
+	assert np.array_equal(heavy.rows, exact.rows[frequent]) and np.array_equal(heavy.counts, exact.counts[frequent])
+	assert np.array_equal(heavy.doc_freqs, exact.doc_freqs[frequent])
+	return len(rows), survives[rare].mean() if rare.any() else 0., sketch.table.nbytes / 1e6, seconds
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Check how many windows the heavy-hitter sketch prunes at full-corpus size.')
+	parser.add_argument('--tokens', type=int, default=5000000)
+	parser.add_argument('--vocab-size', type=int, default=20000)
+	parser.add_argument('--orders', type=int, nargs='+', default=[5, 6, 7, 8])
+	parser.add_argument('--min-count', type=int, default=2)
+	parser.add_argument('--max-survival', type=float, default=0.1, help='largest share of rare windows allowed through')
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+
+	stream, line_bounds, doc_bounds = zipf_corpus(np.random.default_rng(args.seed), args.tokens, args.vocab_size)
+	approximate = HeavyHitterCounting(min(args.orders), args.min_count, seed=args.seed)
+	print('{} tokens, {} lines, {} documents, {}'.format(len(stream), len(line_bounds) - 1, len(doc_bounds) - 1, approximate))
+	print('{:<8}{:>12}{:>18}{:>12}{:>10}'.format('order', 'windows', 'rare surviving', 'sketch MB', 'seconds'))
+	for n in args.orders:
+		windows, survival, megabytes, seconds = check_order(stream, line_bounds, doc_bounds, n, approximate)
+		print('{:<8}{:>12}{:>17.2%}{:>12.1f}{:>10.2f}'.format(n, windows, survival, megabytes, seconds))
+		assert survival <= args.max_survival, 'order {}: {:.1%} of rare windows survive the sketch'.format(n, survival)
+	print('every order prunes, drops no frequent ngram and keeps exact counts')
@@ -0,0 +1,96 @@
+import sys
+sys.path.append('.')
+import os
+import csv
+import random
+import argparse
+
+"""
+Deterministic generator of TED-like data in the shape of the Kaggle files:
+ted_main.csv (title, main_speaker, event, duration, views, tags, url) and
+transcripts.csv (transcript, url). Words follow a Zipf distribution over a
+vocabulary of common English words and made-up ones; transcripts carry
+(Laughter), (Applause), other parentheticals and ♪ music lines, and the urls
+end in a newline as in the real data. The same arguments always produce the
+same files.
+"""
+
+TAGS = ['technology', 'science', 'global issues', 'culture', 'TEDx', 'design', 'business',
+		'entertainment', 'health', 'innovation', 'society', 'art', 'social change', 'future',
+		'communication', 'biology', 'humanity', 'collaboration', 'environment', 'medicine',
+		'brain', 'economics', 'education', 'music', 'humor', 'psychology', 'politics', 'cities']
+
+COMMON_WORDS = ['the', 'and', 'to', 'of', 'a', 'that', 'i', 'in', 'it', 'you', 'we', 'is', 'this',
+				'so', 'they', 'was', 'for', 'are', 'have', 'but', 'what', 'on', 'with', 'can', 'about',
+				'there', 'be', 'as', 'at', 'all', 'not', 'do', 'my', 'one', 'people', "it's", 'like',
+				'if', 'our', 'from', 'now', 'just', 'these', 'an', 'or', 'because', 'when', 'think',
+				'know', 'really', 'world', 'going', 'very', 'time', 'life', 'thing', 'new', "don't",
+				'data', 'brain', 'water', 'music', 'children', 'women', 'story', 'change', 'future']
+
+PARENTHETICALS = ['(Laughter)'] * 8 + ['(Applause)'] * 3 + ['(Music)', '(Video)', '(Cheers)']
+
+def make_vocabulary(rng, vocab_size):
+	letters = 'abcdefghijklmnoprstuvwy'
+	made_up = [''.join(rng.choice(letters) for __ in range(rng.randint(2, 10)))
+				for __ in range(max(vocab_size - len(COMMON_WORDS), 0))]
+	return COMMON_WORDS + made_up
+
+def zipf_cum_weights(vocab):
+	"""cumulative weights giving the word of rank r a weight of 1/r"""
+	cum_weights = []
+	total = 0.
+	for rank in range(len(vocab)):
+		total += 1. / (rank + 1)
+		cum_weights.append(total)
+	return cum_weights
+
+def make_transcript(rng, vocab, cum_weights, num_words):
+	sentences = []
+	written = 0
+	while written < num_words:
+		words = rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(3, 18))
+		written += len(words)
+		words[0] = words[0].capitalize()
+		if rng.random() < 0.15:
+			words.insert(rng.randint(1, len(words)), '—')
+		sentence = ' '.join(words) + rng.choice(['.', '.', '.', '?', '!', ':', ','])
+		r = rng.random()
+		if r < 0.12:
+			sentence += ' ' + rng.choice(PARENTHETICALS)
+		elif r < 0.13:
+			sentence += ' ♫ ' + ' '.join(rng.choices(vocab[:50], k=4)) + ' ♫'
+		sentences.append(sentence)
+	return ' '.join(sentences)
+
+def write_corpus(dirpath, num_talks=500, words_per_talk=2000, vocab_size=20000, seed=0):
+	"""writes ted_main.csv and transcripts.csv under dirpath and returns their paths"""
+	rng = random.Random(seed)
+	vocab = make_vocabulary(rng, vocab_size)
+	cum_weights = zipf_cum_weights(vocab)
+	os.makedirs(dirpath, exist_ok=True)
+	main_path = os.path.join(dirpath, 'ted_main.csv')
+	transcripts_path = os.path.join(dirpath, 'transcripts.csv')
+	with open(main_path, 'w', newline='', encoding='utf-8') as main_file, \
+			open(transcripts_path, 'w', newline='', encoding='utf-8') as transcripts_file:
+		main_writer, transcripts_writer = csv.writer(main_file), csv.writer(transcripts_file)
+		main_writer.writerow(['title', 'main_speaker', 'event', 'duration', 'views', 'tags', 'url'])
+		transcripts_writer.writerow(['transcript', 'url'])
+		for i in range(num_talks):
+			url = 'https://www.ted.com/talks/synthetic_talk_{}\n'.format(i)
+			tags = rng.sample(TAGS, rng.randint(2, 8))
+			num_words = max(int(rng.gauss(words_per_talk, words_per_talk / 4)), 50)
+			main_writer.writerow(['Synthetic talk {}'.format(i), 'Speaker {}'.format(rng.randint(0, num_talks)),
+									'TED{}'.format(2006 + i % 12), num_words // 2, rng.randint(10000, 5000000), repr(tags), url])
+			transcripts_writer.writerow([make_transcript(rng, vocab, cum_weights, num_words), url])
+	return main_path, transcripts_path
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Write a synthetic TED-like corpus.')
+	parser.add_argument('dirpath')
+	parser.add_argument('--talks', type=int, default=500)
+	parser.add_argument('--words-per-talk', type=int, default=2000)
+	parser.add_argument('--vocab-size', type=int, default=20000)
+	parser.add_argument('--seed', type=int, default=0)
+	args = parser.parse_args()
+	for path in write_corpus(args.dirpath, args.talks, args.words_per_talk, args.vocab_size, args.seed):
+		print(path)
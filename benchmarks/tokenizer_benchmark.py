@@ -0,0 +1,107 @@
+import sys
+sys.path.append('.')
+import re
+import time
+import random
+import argparse
+
+from utilities import librarian
+from benchmarks.synthetic_corpus import make_vocabulary, make_transcript, zipf_cum_weights, PARENTHETICALS
+
+"""
+Checks that librarian's cleaner (one compiled scan for all parentheticals, one
+search for excluded characters per transcript) and tokens_from_text give
+exactly the lines of the cleaner they replaced, kept below as the reference,
+and reports the throughput of both in MB/s of transcript text:
+
+	python benchmarks/tokenizer_benchmark.py --talks 300
+
+The check covers synthetic transcripts and edge cases: nested, unclosed and
+multi-line parentheticals, events inside parentheticals, punctuation that
+only forms an event once removed, music lines and missing transcripts.
+"""
+
+### REFERENCE CLEANER ###
+
+def reference_lines_from_text(text):
+	if not isinstance(text, str):
+		return []
+	lines = reference_clean(text).split('. ')
+	return [line.strip() for line in lines if len(line) > 0 and not any(ch in librarian.exclude_set for ch in line)]
+
+def reference_clean(text):
+	text = text.replace(',', '')
+	text = text.replace('"', '')
+	text = text.replace('?', '.')
+	text = text.replace('!', '.')
+	text = text.replace(':', '.')
+	text = text.replace('.','. ')
+	text = text.replace('—',' ')
+	text = text.replace("(Applause)", ". <Applause>. ")
+	text = text.replace("(Laughter)", ". <Laughter>. ")
+	return re.sub(r'\(.*?\)', '', text)
+
+def reference_tokens_from_text(text):
+	return [line.lower().split() for line in reference_lines_from_text(text)]
+
+EDGE_CASES = [
+	float('nan'), '', '.', '. . .', ' .  . ', 'no punctuation at all',
+	'Hello, world! How are you? Fine: thanks.',
+	'He said "yes" — then left.', 'Wait...what?!', 'a.b.c',
+	'(Laughter)', '(Applause)(Laughter)', 'Funny. (Laughter) Right? (Applause)',
+	'Words (Music) more words (Video: a clip) end.',
+	'a (b (Laughter) c) d.', 'a (b (Laughter) c d', 'a ((Laughter) b) c', '((Laughter))',
+	'x (Laughter) y) z', 'a (b) c) d (e', 'unclosed (paren here. And more',
+	'(Laugh,ter) and (Applau"se)', '(Laughter!) (Applause.)', '(Laughter)(Applause)).',
+	'line one (spans\na newline) two. (one line) three',
+	'♫ la la ♫. Next line. ♪ hum. After.', 'A♪B. C',
+	'Ünïcödé İstanbul. ΣΊΣΥΦΟΣ Straße.', 'tabs\tand\nnewlines.\r\nok',
+]
+
+def fuzz_cases(rng, count):
+	"""random strings over the characters the cleaner treats specially"""
+	pieces = ['(', ')', '.', ',', '"', '?', '!', ':', '—', ' ', '\n', '♫', 'a', 'Word', '(Laughter)', '(Applause)',
+				'Laughter', 'Applause', '(Laugh', 'ter)', '. ', '<x>']
+	return [''.join(rng.choice(pieces) for __ in range(rng.randint(1, 40))) for __ in range(count)]
+
+def check_equivalence(texts):
+	"""number of texts checked; raises AssertionError at the first difference"""
+	for text in texts:
+		expected = reference_lines_from_text(text)
+		assert librarian.lines_from_text(text) == expected, (text, librarian.lines_from_text(text), expected)
+		assert librarian.tokens_from_text(text) == [line.lower().split() for line in expected], text
+	return len(texts)
+
+def throughput(func, texts, megabytes, repeat):
+	best = float('inf')
+	for __ in range(repeat):
+		start = time.perf_counter()
+		for text in texts:
+			func(text)
+		best = min(best, time.perf_counter() - start)
+	return megabytes / best
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Check and time the compiled transcript cleaner against the sequential one.')
+	parser.add_argument('--talks', type=int, default=300)
+	parser.add_argument('--words-per-talk', type=int, default=2000)
+	parser.add_argument('--fuzz', type=int, default=20000)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--repeat', type=int, default=3)
+	args = parser.parse_args()
+
+	rng = random.Random(args.seed)
+	vocab = make_vocabulary(rng, 20000)
+	cum_weights = zipf_cum_weights(vocab)
+	transcripts = [make_transcript(rng, vocab, cum_weights, args.words_per_talk) for __ in range(args.talks)]
+
+	checked = check_equivalence(EDGE_CASES + PARENTHETICALS + fuzz_cases(rng, args.fuzz) + transcripts)
+	print('{} texts give identical lines and tokens'.format(checked))
+
+	megabytes = sum(len(text.encode('utf-8')) for text in transcripts) / 1e6
+	print('{:.1f} MB of transcripts'.format(megabytes))
+	for name, func in [('reference lines_from_text', reference_lines_from_text),
+						('lines_from_text', librarian.lines_from_text),
+						('reference tokens (lines + lower/split)', reference_tokens_from_text),
+						('tokens_from_text', librarian.tokens_from_text)]:
+		print('{:<40}{:>10.1f} MB/s'.format(name, throughput(func, transcripts, megabytes, args.repeat)))
@@ -0,0 +1,97 @@
+import re
+
+import numpy as np
+
+from utilities.ngram_utils import window_starts, ngram_id_rows
+from models.tag_index import TagIndex
+from utilities.lazy_list import LazyList
+
+"""
+Rates at which ngrams are followed by audience events. An event is a line
+holding only a bracketed label, as handle_parentheticals leaves <Laughter> and
+<Applause>; a line directly followed by an event line in the same talk is
+labeled with that event. One pass per order, made when the order is first
+queried, counts the ngrams of every labeled line under its event and talk. Overall counts come from the model, so any
+event's rates, overall or within the talks of one tag, are two bincounts away.
+"""
+
+EVENT_PATTERN = re.compile(r'^<[^<>\s]+>$')
+
+class EventCounts(object):
+	"""occurrences of each (event, document, store index) in lines followed by that event"""
+
+	def __init__(self, events, docs, indices, counts):
+		self.events = events
+		self.docs = docs
+		self.indices = indices
+		self.counts = counts
+
+class EventRates(object):
+
+	def __init__(self, ng_model, tags_by_doc=None):
+		"""tags_by_doc: the set of tags of each document, for per-tag rates; defaults to the model's"""
+		self.ng_model = ng_model
+		self.tag_index = TagIndex(tags_by_doc) if tags_by_doc is not None else ng_model.tag_index
+		vocab = ng_model.vocab
+		self.events = [token for token in vocab.tokens if EVENT_PATTERN.match(token)]
+		self.line_docs = np.repeat(np.arange(len(ng_model.doc_bounds) - 1), np.diff(ng_model.doc_bounds))
+		self.line_events = self.following_events()
+		self.event_counts = LazyList(ng_model.max_ng_size, lambda i: self.count_order(i + 1))
+
+	def following_events(self):
+		"""index into self.events of the event line after each line of the same document, or -1"""
+		model = self.ng_model
+		event_index = np.full(len(model.vocab), -1)
+		event_index[[model.vocab.token_ids[event] for event in self.events]] = np.arange(len(self.events))
+		line_starts = model.line_bounds[:-1]
+		line_events = np.where(np.diff(model.line_bounds) == 1,
+								event_index[model.stream[np.minimum(line_starts, len(model.stream) - 1)]], -1)
+		following = np.append(line_events[1:], -1)
+		following[:-1][self.line_docs[:-1] != self.line_docs[1:]] = -1
+		return following
+
+	def count_order(self, n):
+		model = self.ng_model
+		store = model.ng_stores[n-1]
+		starts = window_starts(model.line_bounds, n)
+		lines = np.searchsorted(model.line_bounds, starts, side='right') - 1
+		labeled = self.line_events[lines] >= 0
+		starts, lines = starts[labeled], lines[labeled]
+		indices = store.find(ngram_id_rows(model.stream, starts, n))
+		found = indices >= 0		# pruned from an approximately counted order
+		num_docs = len(model.doc_bounds) - 1
+		keys = (self.line_events[lines[found]] * num_docs + self.line_docs[lines[found]]) * len(store) + indices[found]
+		keys, counts = np.unique(keys, return_counts=True)
+		return EventCounts(keys // len(store) // num_docs, keys // len(store) % num_docs, keys % len(store), counts)
+
+	def doc_mask(self, tag):
+		return self.tag_index.mask(tag)
+
+	def overall_counts(self, n, tag=None):
+		"""counts of every ngram of size n, in all documents or in those with the tag"""
+		if tag is None:
+			return self.ng_model.ng_stores[n-1].counts
+		order = self.ng_model.order_counts[n-1]
+		entries = np.repeat(self.doc_mask(tag), np.diff(order.tf_indptr))
+		return np.bincount(order.tf_indices[entries], weights=order.tf_values[entries], minlength=len(order.rows))
+
+	def rate_arrays(self, event, n, count_threshold=1, tag=None):
+		"""store indices of the ngrams followed by the event, and their rates, among those occurring count_threshold times"""
+		counts = self.event_counts[n-1]
+		selected = counts.events == self.events.index(event.lower())
+		if tag is not None:
+			selected &= self.doc_mask(tag)[counts.docs]
+		overall = self.overall_counts(n, tag)
+		event_counts = np.bincount(counts.indices[selected], weights=counts.counts[selected], minlength=len(overall))
+		indices = np.flatnonzero((event_counts > 0) & (overall >= count_threshold))
+		return indices, event_counts[indices] / overall[indices]
+
+	def rates(self, event, n, count_threshold=1, tag=None):
+		indices, rates = self.rate_arrays(event, n, count_threshold, tag)
+		return dict(zip(self.ng_model.ngram_strings(n, indices), rates.tolist()))
+
+	def top_rates(self, event, n, count_threshold=1, k=10, tag=None):
+		"""the k ngrams followed by the event at the highest rates, as a ranked [(ngram, rate)] list"""
+		indices, rates = self.rate_arrays(event, n, count_threshold, tag)
+		top = np.argsort(-rates, kind='stable')[:k]
+		return list(zip(self.ng_model.ngram_strings(n, indices[top]), rates[top].tolist()))
@@ -0,0 +1,33 @@
+import numpy as np
+
+"""
+Positional inverted index over an encoded corpus: for every token id, the sorted
+stream positions where it occurs. A phrase query reads only the postings of the
+phrase's rarest token and checks its neighbours in the stream.
+"""
+
+class PositionalIndex(object):
+
+	def __init__(self, stream, line_bounds, vocab_size):
+		self.stream = stream
+		self.line_bounds = line_bounds
+		self.positions = np.argsort(stream, kind='stable')
+		self.postings_ptr = np.concatenate([[0], np.cumsum(np.bincount(stream, minlength=vocab_size))])
+
+	def postings(self, token_id):
+		return self.positions[self.postings_ptr[token_id]:self.postings_ptr[token_id+1]]
+
+	def phrase_windows(self, phrase_ids, offset, width):
+		"""
+		Start positions of every window of `width` tokens that lies within one line
+		and has the phrase at position `offset` of the window.
+		"""
+		pivot = min(range(len(phrase_ids)), key=lambda j: self.postings_ptr[phrase_ids[j]+1] - self.postings_ptr[phrase_ids[j]])
+		pivot_positions = self.postings(phrase_ids[pivot])
+		starts = pivot_positions - pivot - offset
+		lines = np.searchsorted(self.line_bounds, pivot_positions, side='right') - 1
+		starts = starts[(starts >= self.line_bounds[lines]) & (starts + width <= self.line_bounds[lines+1])]
+		for j, token_id in enumerate(phrase_ids):
+			if j != pivot:
+				starts = starts[self.stream[starts + offset + j] == token_id]
+		return starts
@@ -0,0 +1,125 @@
+import numpy as np
+
+from utilities.ngram_utils import ngram_id_rows
+from models.ngram_store import NgramStore, MAX_ID
+from utilities.lazy_list import LazyList
+from utilities.instrumentation import span
+
+"""
+Interpolated Kneser-Ney smoothing with modified discounts (Chen & Goodman),
+over the ngram stores of a model. The top order is estimated from raw counts and
+every lower order from continuation counts: the number of distinct tokens seen
+before an ngram, plus one if it opens a line, which stands in for a <s> pad.
+Discounts and backoff weights are tables built once per order, when a score
+first needs that order; scoring a batch is a few binary searches per order over
+all of its positions at once.
+"""
+
+class KneserNeyLevel(object):
+	"""discounts, context totals and backoff weights of one order"""
+
+	def __init__(self, store, counts):
+		self.store = store
+		self.counts = counts
+		self.discounts = modified_discounts(counts)
+		applied = np.where(counts > 0, self.discounts[np.minimum(counts, 3)], 0)
+		bounds = store.context_bounds()[:-1]
+		totals = np.add.reduceat(counts, bounds) if len(bounds) else counts[:0]
+		seen = totals > 0
+		self.contexts = NgramStore(store.rows[bounds[seen], :-1], totals[seen]) if store.n > 1 else None
+		self.totals = totals[seen]
+		self.gammas = (np.add.reduceat(applied, bounds)[seen] if len(bounds) else applied[:0]) / self.totals
+
+	def context_index(self, contexts):
+		if self.contexts is None:
+			return np.zeros(len(contexts), dtype=np.int64) if len(self.totals) else np.full(len(contexts), -1)
+		return self.contexts.find(contexts)
+
+	def interpolate(self, rows, lower):
+		"""P(last id | preceding ids) of each row, backing off to the lower order's probabilities"""
+		contexts = self.context_index(rows[:, :-1])
+		seen = contexts >= 0
+		found = self.store.find(rows[seen])
+		counts = np.where(found >= 0, self.counts[found], 0)
+		discounted = np.maximum(counts - self.discounts[np.minimum(counts, 3)], 0)
+		probs = lower.copy()
+		c = contexts[seen]
+		probs[seen] = discounted / self.totals[c] + self.gammas[c] * lower[seen]
+		return probs
+
+class KneserNey(object):
+
+	def __init__(self, stores, stream, line_bounds):
+		self.stores = stores
+		self.stream = stream
+		self.line_bounds = line_bounds
+		self.top_levels = LazyList(len(stores), self.build_top_level)
+		self.lower_levels = LazyList(len(stores) - 1, self.build_lower_level)
+		self._vocab_size = None
+
+	@property
+	def vocab_size(self):
+		"""distinct tokens in the stream, so tokens left only in removed documents don't count"""
+		if self._vocab_size is None:
+			self._vocab_size = int(np.count_nonzero(np.bincount(self.stream)))
+		return self._vocab_size
+
+	def build_top_level(self, i):
+		"""the level of the (i+1)-grams as the highest order, from raw counts"""
+		with span('kneser-ney {}-grams'.format(i + 1)):
+			return KneserNeyLevel(self.stores[i], self.stores[i].counts)
+
+	def build_lower_level(self, i):
+		"""the level of the (i+1)-grams below a higher order, from continuation counts"""
+		with span('kneser-ney {}-gram continuations'.format(i + 1)):
+			return KneserNeyLevel(self.stores[i], continuation_counts(self.stores, i + 1, self.stream, self.line_bounds))
+
+	def log_probs(self, ids, line_bounds, n):
+		"""
+		log P(token | up to n-1 preceding tokens of its line) at every position of
+		an encoded batch; out-of-vocabulary tokens are MAX_ID and get the mass that
+		the unigram level leaves to unseen tokens
+		"""
+		levels = self.lower_levels[:n-1] + [self.top_levels[n-1]]
+		offsets = np.arange(len(ids)) - np.repeat(line_bounds[:-1], np.diff(line_bounds))
+		probs = np.full(len(ids), 1 / (self.vocab_size + 1))
+		for k, level in enumerate(levels, 1):
+			at = np.flatnonzero(offsets >= k - 1)
+			rows = ngram_id_rows(ids, at - k + 1, k)
+			probs[at] = level.interpolate(rows, probs[at])
+		return np.log(probs)
+
+def continuation_counts(stores, k, stream, line_bounds):
+	"""for each k-gram, the distinct tokens preceding it, counting a line start as one more"""
+	store = stores[k-1]
+	found = store.find(stores[k].rows[:, 1:])
+	counts = np.bincount(found[found >= 0], minlength=len(store)).astype(np.int64)
+	starts = line_bounds[:-1][np.diff(line_bounds) >= k]
+	opening = store.find(ngram_id_rows(stream, starts, k))
+	counts[np.unique(opening[opening >= 0])] += 1
+	return counts
+
+def modified_discounts(counts):
+	"""
+	[0, D1, D2, D3+] estimated from the number of ngrams seen once to four times;
+	0.75 (at most i) where those counts cannot support an estimate
+	"""
+	n1, n2, n3, n4 = np.bincount(counts[(counts > 0) & (counts <= 4)], minlength=5)[1:5].tolist()
+	discounts = np.array([0., 0.75, 0.75, 0.75])
+	if n1 and n2:
+		y = n1 / (n1 + 2 * n2)
+		discounts[1] = 1 - 2 * y * n2 / n1
+		if n3:
+			discounts[2] = 2 - 3 * y * n3 / n2
+			if n4:
+				discounts[3] = 3 - 4 * y * n4 / n3
+	return np.clip(discounts, 0, [0, 1, 2, 3])
+
+def encode_batch(lines, vocab):
+	"""(ids, line_bounds) of lowercased, whitespace-split lines, MAX_ID for unknown tokens"""
+	get = vocab.token_ids.get
+	ids, line_bounds = [], [0]
+	for line in lines:
+		ids.extend(get(token, MAX_ID) for token in line.lower().split())
+		line_bounds.append(len(ids))
+	return np.array(ids, dtype=np.int64), np.array(line_bounds, dtype=np.int64)
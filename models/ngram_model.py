@@ -1,39 +1,404 @@
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from utilities import librarian
 from utilities.librarian import flatten_list
+from utilities.vocabulary import Vocabulary
+from utilities.lazy_list import LazyList
 
-from utilities.dictionary import (
-	enter_nested_item,
-	keywise_quotients,
-	normalize
-)
+from utilities.dictionary import enter_nested_item
 
 from utilities.ngram_utils import (
-	ngrams_for_line,
 	split_ngrams_for_sequence,
-	ngram_counts_for_lines,
-	model_from_counts,
-	tf_idf
+	encode_documents,
+	count_ngram_order,
+	merge_order_counts,
+	select_documents,
+	count_shard,
+	remap_order_count_list,
+	merge_order_count_lists,
+	tree_reduce,
+	window_starts,
+	count_windows,
+	ngram_id_rows,
+	row_keys,
+	rows_from_keys,
+	OrderCounts,
+	TfidfMatrix
+)
+
+from models.ngram_store import (
+	NgramStore,
+	NgramCounts,
+	NgramValues,
+	NgramRates,
+	ConditionalModel,
+	document_views
+)
+
+from models.ngram_trie import NgramTrie
+from models.inverted_index import PositionalIndex
+from models.tag_index import TagIndex
+from models.kneser_ney import KneserNey, encode_batch
+from models.sketches import (
+	CountMinSketch,
+	HeavyHitterCounting,
+	count_heavy_ngram_order,
+	hash_rows
+)
+
+from utilities.instrumentation import span
+
+from models.snapshot import (
+	snapshot_key,
+	write_snapshot,
+	read_snapshot
 )
 
 ### CONSTANTS ###
 
 OOV_PENALTY = 0.0000000000000001
+ORDER_ARRAYS = ['rows', 'counts', 'doc_freqs', 'tf_indptr', 'tf_indices', 'tf_values']
+TFIDF_ARRAYS = ['idf', 'column_mask', 'indptr', 'indices', 'tfs', 'data', 'entry_docs', 'row_norms']
 
 class NgramModel(object):
 
-	def __init__(self, df, max_ng_size):
-		self.lines_by_doc = df['lines']
-		self.lines = flatten_list(df['lines'])
+	def __init__(self, df, max_ng_size, approximate=None, num_workers=1):
+		"""
+		approximate: optional HeavyHitterCounting for the high orders
+		num_workers > 1 counts shards of the documents on a process pool
+		"""
+		self.build(df['lines'], max_ng_size, approximate, num_workers)
+		self._lines_by_doc = df['lines']
+		self.urls = list(df['url']) if 'url' in df else [None] * len(df)
+		self.tags_by_doc = list(df['tags']) if 'tags' in df else [set() for __ in range(len(df))]
+
+	@classmethod
+	def from_talks(cls, talks, max_ng_size, approximate=None):
+		"""
+		Builds a model from an iterable of talk records, e.g. librarian.stream_talks(),
+		encoding each talk as it arrives and keeping only its token ids. Records with
+		'tokens' (stream_talks(tokens_only=True)) are encoded as they are, else 'lines'
+		are split. Documents are kept in the order the records come in; from
+		stream_talks that is transcripts.csv order without talks lacking a
+		transcript, so document indices need not line up with load_dataframe().
+		"""
+		model = cls.__new__(cls)
+		model.urls = []
+		model.tags_by_doc = []
+
+		def lines_by_doc():
+			for talk in talks:
+				model.urls.append(talk['url'])
+				model.tags_by_doc.append(talk['tags'])
+				yield talk['tokens'] if 'tokens' in talk else talk['lines']
+
+		model.build(lines_by_doc(), max_ng_size, approximate)
+		return model
+
+	def build(self, lines_by_doc, max_ng_size, approximate=None, num_workers=1):
+		self.snapshot_path = None		# set once the model is saved or loaded
+		self._lines_by_doc = None
+		self._line_text = None
+		self._lines = None
 		self.max_ng_size = max_ng_size
+		self.approximate = approximate
 
-		self.ng_counts = []		# ngram counts by size
-		self.ng_rates = []		# ngram rates by size
-		self.ng_models = []		# P(last token | all preceding tokens)
-		self.populate_ngrams()
+		self.sketches = {}		# Count-Min Sketches of the approximately counted orders, by size
+		for n in range(1, max_ng_size+1):
+			if approximate is not None and approximate.applies_to(n):
+				self.sketches[n] = None
+		self.order_counts = LazyList(max_ng_size, self.count_order)		# counted on first access, unless sharded
+		exact_sizes = [n for n in range(1, max_ng_size+1) if n not in self.sketches]
+		if num_workers > 1:
+			with span('count sharded', workers=num_workers):
+				self.count_sharded(list(lines_by_doc), exact_sizes, num_workers)
+		else:
+			with span('encode') as s:
+				self.vocab = Vocabulary()
+				self.stream, self.line_bounds, self.doc_bounds = encode_documents(lines_by_doc, self.vocab)
+				s.record(documents=len(self.doc_bounds) - 1, lines=len(self.line_bounds) - 1,
+							tokens=len(self.stream), vocabulary=len(self.vocab))
+		self.populate()
+
+	def materialize(self):
+		"""builds every lazily built artifact of every order now, e.g. to time a full build"""
+		with span('materialize', max_ng_size=self.max_ng_size):
+			for artifacts in (self.order_counts, self.ng_stores, self.ng_counts, self.ng_rates, self.ng_models,
+								self.tfidf_matrices, self.tf_dicts, self.df_dicts, self.tfidf_dicts,
+								self.ng_trie.ids, self.ng_trie.child_ptr, self.kneser_ney.top_levels, self.kneser_ney.lower_levels):
+				list(artifacts)
+			self.unigram_tables, self.bigram_log_probs
+		return self
+
+	def count_order(self, i):
+		"""OrderCounts of the ngrams of size i+1, exact or, for orders under self.approximate, pruned by a sketch"""
+		n = i + 1
+		if n in self.sketches:
+			with span('count {}-grams approximately'.format(n)) as s:
+				self.sketches[n] = self.approximate.new_sketch(count_windows(self.line_bounds, n))
+				order = count_heavy_ngram_order(self.stream, self.line_bounds, self.doc_bounds,
+												n, self.sketches[n], self.approximate.min_count)
+				s.record(ngrams=len(order.rows), sketch_width=self.sketches[n].width)
+		else:
+			with span('count {}-grams'.format(n)) as s:
+				order = count_ngram_order(self.stream, self.line_bounds, self.doc_bounds, n)
+				s.record(ngrams=len(order.rows), doc_entries=len(order.tf_indices))
+		return order
+
+	def count_sharded(self, lines_by_doc, sizes, num_workers):
+		"""
+		Map: each worker encodes and counts one contiguous shard of documents.
+		Reduce: shard vocabularies are merged in shard order, which assigns the same
+		ids as encoding the documents serially; then each shard's counts are renamed
+		to those ids and merged pairwise in a tree on the pool.
+		"""
+		bounds = np.linspace(0, len(lines_by_doc), num_workers + 1).astype(int)
+		shards = [lines_by_doc[lo:hi] for lo, hi in zip(bounds[:-1], bounds[1:]) if hi > lo]
+		with Pool(num_workers) as pool:
+			tokens, streams, line_bounds, doc_bounds, orders = zip(*pool.starmap(count_shard, [(shard, sizes) for shard in shards]))
+			self.vocab = Vocabulary()
+			id_maps = [np.array(self.vocab.encode(shard_tokens), dtype=np.int64) for shard_tokens in tokens]
+			self.stream = np.concatenate([id_map[stream] for id_map, stream in zip(id_maps, streams)]).astype(np.int32)
+			self.line_bounds = concatenate_bounds(line_bounds)
+			self.doc_bounds = concatenate_bounds(doc_bounds)
+			parts = pool.starmap(remap_order_count_list, zip(orders, id_maps))
+			for n, order in zip(sizes, tree_reduce(pool, parts, merge_order_count_lists)):
+				self.order_counts[n-1] = order
 
-		self.tf_dicts = []		# term frequency
-		self.df_dicts = []		# doc frequency
-		self.tfidf_dicts = []	# term frequency / inverse document frequency
+	def populate(self):
+		"""
+		Sets up the per-order artifacts as LazyLists: each is built from order_counts
+		the first time it is read, so a procedure pays only for the orders and views it uses.
+		"""
+		self.populate_ngrams()
 		self.populate_tfidf()
+		self._unigram_tables = None
+		self._bigram_log_probs = None
+		self._positional_index = None
+		self._tag_index = None
+
+	### SNAPSHOTS ###
+
+	@classmethod
+	def cached(cls, truncate=2500, max_ng_size=4, cache_dir='cache', approximate=None, **load_kwargs):
+		"""
+		Opens the snapshot for this corpus and these parameters, building and saving
+		it first if the source CSVs or the cleaning code have changed since.
+		"""
+		key = snapshot_key(librarian.corpus_fingerprint(), truncate, max_ng_size, approximate)
+		path = os.path.join(cache_dir, 'ngram_model_' + key)
+		model = cls.load(path)
+		if model is None:
+			model = cls(librarian.load_dataframe(truncate=truncate, **load_kwargs), max_ng_size, approximate)
+			model.save(path)
+		return model
+
+	def save(self, path):
+		arrays, objects = self.snapshot_arrays()
+		with span('save snapshot'):
+			write_snapshot(path, arrays, objects)
+		self.snapshot_path = path
+
+	@classmethod
+	def load(cls, path):
+		"""a model backed by the memory-mapped arrays of a snapshot, or None if there is none"""
+		with span('read snapshot'):
+			snapshot = read_snapshot(path)
+		if snapshot is None:
+			return None
+		model = cls.from_arrays(*snapshot)
+		model.snapshot_path = path
+		return model
+
+	def snapshot_arrays(self, tfidf=False):
+		"""
+		(arrays, objects) that from_arrays rebuilds the model from; counts every order.
+		The lines are kept as one UTF-8 array with offsets, decoded only when read.
+		tfidf: also keep the TF-IDF matrices of every order, building them first
+		"""
+		arrays = {'stream': self.stream, 'line_bounds': self.line_bounds, 'doc_bounds': self.doc_bounds}
+		arrays['line_text'], arrays['line_offsets'] = self._line_text or encode_line_text(self.lines_by_doc)
+		for n, counts in enumerate(self.order_counts, 1):
+			for name in ORDER_ARRAYS:
+				arrays['{}_{}'.format(name, n)] = getattr(counts, name)
+		for n, sketch in self.sketches.items():
+			arrays['sketch_{}'.format(n)] = sketch.table
+			arrays['sketch_total_{}'.format(n)] = np.array([sketch.total], dtype=np.int64)
+		if tfidf:
+			for n, matrix in enumerate(self.tfidf_matrices, 1):
+				for name in TFIDF_ARRAYS:
+					arrays['tfidf_{}_{}'.format(name, n)] = getattr(matrix, name)
+		objects = {'vocab': self.vocab.tokens, 'urls': self.urls, 'tags': [sorted(tags) for tags in self.tags_by_doc],
+					'approximate': vars(self.approximate) if self.approximate is not None else None}
+		return arrays, objects
+
+	@classmethod
+	def from_arrays(cls, arrays, objects):
+		"""a model over the arrays of snapshot_arrays, used as they are, e.g. memory-mapped or in shared memory"""
+		model = cls.__new__(cls)
+		model.snapshot_path = None
+		model._lines_by_doc = None
+		model._line_text = arrays['line_text'], arrays['line_offsets']
+		model._lines = None
+		model.urls = objects['urls']
+		model.tags_by_doc = [set(tags) for tags in objects['tags']]
+		model.vocab = Vocabulary(objects['vocab'])
+		model.stream, model.line_bounds, model.doc_bounds = arrays['stream'], arrays['line_bounds'], arrays['doc_bounds']
+		model.max_ng_size = 0
+		while 'rows_{}'.format(model.max_ng_size+1) in arrays:
+			model.max_ng_size += 1
+		model.order_counts = LazyList(model.max_ng_size, model.count_order,
+										[OrderCounts(*[arrays['{}_{}'.format(name, n)] for name in ORDER_ARRAYS])
+										for n in range(1, model.max_ng_size+1)])
+		model.approximate = HeavyHitterCounting(**objects['approximate']) if objects['approximate'] else None
+		model.sketches = {}
+		for n in range(1, model.max_ng_size+1):
+			if 'sketch_{}'.format(n) in arrays:
+				table = arrays['sketch_{}'.format(n)]
+				total = int(arrays['sketch_total_{}'.format(n)][0])
+				model.sketches[n] = CountMinSketch(table.shape[1], table.shape[0], model.approximate.seed, table, total)
+		model.populate()
+		for n in range(1, model.max_ng_size+1):
+			if 'tfidf_data_{}'.format(n) in arrays:
+				model.tfidf_matrices[n-1] = TfidfMatrix.from_arrays(*[arrays['tfidf_{}_{}'.format(name, n)] for name in TFIDF_ARRAYS])
+		return model
+
+	### INCREMENTAL UPDATES ###
+
+	def add_documents(self, df_rows):
+		"""
+		Adds talks (anything with 'lines' and 'url' columns and optionally 'tags', e.g. rows of load_dataframe())
+		by counting only the new talks and merging their counts into the model.
+		Approximately counted orders are recounted, since pruned ngrams may now be frequent;
+		orders not counted yet are simply counted over the whole corpus when first read.
+		"""
+		lines_by_doc = list(df_rows['lines'])
+		self.decode_line_text()
+		with span('add documents', documents=len(lines_by_doc)):
+			stream, line_bounds, doc_bounds = encode_documents(lines_by_doc, self.vocab)
+			for n in range(1, self.max_ng_size+1):
+				if n not in self.sketches and self.order_counts.is_built(n-1):
+					new_counts = count_ngram_order(stream, line_bounds, doc_bounds, n)
+					self.order_counts[n-1] = merge_order_counts(self.order_counts[n-1], new_counts)
+		self.stream = np.concatenate([self.stream, stream])
+		self.line_bounds = concatenate_bounds([self.line_bounds, line_bounds])
+		self.doc_bounds = concatenate_bounds([self.doc_bounds, doc_bounds])
+		self.urls = self.urls + list(df_rows['url'])
+		self.tags_by_doc = self.tags_by_doc + (list(df_rows['tags']) if 'tags' in df_rows else [set() for __ in lines_by_doc])
+		if self._lines_by_doc is not None:
+			self._lines_by_doc = list(self._lines_by_doc) + lines_by_doc
+		self.refresh()
+
+	def remove_documents(self, urls):
+		"""drops the talks with the given urls, subtracting their counts from the model"""
+		urls = set(urls)
+		keep_docs = np.array([url not in urls for url in self.urls], dtype=bool)
+		if keep_docs.all():
+			return
+		self.decode_line_text()
+		with span('remove documents', documents=int((~keep_docs).sum())):
+			for n in range(1, self.max_ng_size+1):
+				if n not in self.sketches and self.order_counts.is_built(n-1):
+					self.order_counts[n-1] = select_documents(self.order_counts[n-1], keep_docs)
+		keep_lines = np.repeat(keep_docs, np.diff(self.doc_bounds))
+		self.stream = self.stream[np.repeat(keep_lines, np.diff(self.line_bounds))]
+		self.line_bounds = np.concatenate([[0], np.cumsum(np.diff(self.line_bounds)[keep_lines])])
+		self.doc_bounds = np.concatenate([[0], np.cumsum(np.diff(self.doc_bounds)[keep_docs])])
+		self.urls = [url for url, keep in zip(self.urls, keep_docs) if keep]
+		self.tags_by_doc = [tags for tags, keep in zip(self.tags_by_doc, keep_docs) if keep]
+		if self._lines_by_doc is not None:
+			self._lines_by_doc = [lines for lines, keep in zip(self._lines_by_doc, keep_docs) if keep]
+		self.refresh()
+
+	def refresh(self):
+		"""
+		Drops the artifacts built over the old counts, and the approximately counted
+		orders; all of them are rebuilt from the updated corpus when next read.
+		"""
+		self._lines = None
+		for n in self.sketches:
+			self.sketches[n] = None
+			self.order_counts.reset(n-1)
+		self.populate()
+
+	### ACCESSORS ###
+
+	@property
+	def lines_by_doc(self):
+		"""
+		each document's lines; a snapshot's are decoded on first access, and a model
+		built from a stream rebuilds them, lowercased, from its token ids
+		"""
+		if self._lines_by_doc is None:
+			self.decode_line_text()
+		if self._lines_by_doc is None:
+			self._lines_by_doc = [self.decode_lines(lo, hi) for lo, hi in zip(self.doc_bounds[:-1], self.doc_bounds[1:])]
+		return self._lines_by_doc
+
+	def decode_line_text(self):
+		"""turns a snapshot's line text into lines_by_doc, e.g. before the documents change"""
+		if self._line_text is not None:
+			with span('decode lines'):
+				self._lines_by_doc = decode_line_text(*self._line_text, self.doc_bounds)
+			self._line_text = None
+
+	@property
+	def lines(self):
+		if self._lines is None:
+			self._lines = flatten_list(self.lines_by_doc)
+		return self._lines
+
+	@property
+	def positional_index(self):
+		"""built on the first collocates query, then reused"""
+		if self._positional_index is None:
+			self._positional_index = PositionalIndex(self.stream, self.line_bounds, len(self.vocab))
+		return self._positional_index
+
+	@property
+	def tag_index(self):
+		"""tag -> document index, built on the first tag query"""
+		if self._tag_index is None:
+			self._tag_index = TagIndex(self.tags_by_doc)
+		return self._tag_index
+
+	def tag_counts(self, n, tags=None):
+		"""OrderCounts of size n ngrams with one document per tag, summed from the talks' term frequencies"""
+		return self.tag_index.aggregate(self.order_counts[n-1], tags)
+
+	def top_tag_tfidf_ngrams(self, n, k=10, tags=None, min_doc_freq_threshold=1):
+		"""{tag: [(ngram, tfidf)]} of the k highest scoring ngrams of each tag, taking all of a tag's talks as one document"""
+		tags = self.tag_index.tags if tags is None else list(tags)
+		counts = self.tag_counts(n, tags)
+		indptr, indices, values = TfidfMatrix(counts, min_doc_freq_threshold).top_k(k)
+		ngrams = [' '.join(self.vocab.decode(row)) for row in counts.rows[indices].tolist()]
+		values = values.tolist()
+		return {tag: list(zip(ngrams[lo:hi], values[lo:hi])) for tag, lo, hi in zip(tags, indptr[:-1].tolist(), indptr[1:].tolist())}
+
+	def estimate_count(self, ngram):
+		"""
+		(count, is_estimate) of an ngram. Counts are exact unless the ngram was pruned
+		from an approximately counted order, in which case the sketch's estimate is
+		returned: never below the true count, and above it by at most
+		self.sketches[n].error_bound() with probability 1 - delta.
+		"""
+		tokens = ngram.lower().split()
+		counts = self.get_ngram_counts(len(tokens))
+		if ngram in counts:
+			return counts[ngram], False
+		ids = self.vocab.lookup(tokens)
+		if len(tokens) not in self.sketches or ids is None:
+			return 0, False
+		return int(self.sketches[len(tokens)].estimate(hash_rows(np.array([ids])))[0]), True
+
+	def decode_lines(self, lo, hi):
+		"""lines lo..hi-1 of the corpus, as lowercase text"""
+		tokens = self.vocab.decode(self.stream[self.line_bounds[lo]:self.line_bounds[hi]].tolist())
+		offsets = (self.line_bounds[lo:hi+1] - self.line_bounds[lo]).tolist()
+		return [' '.join(tokens[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
 
 	def get_ngram_counts(self, n):
 		return self.ng_counts[n-1]
@@ -44,35 +409,108 @@ class NgramModel(object):
 	def get_ngram_model(self, n):
 		return self.ng_models[n-1]
 
+	def completions(self, prefix, n):
+		"""{ngram: count} of the ngrams of size n that start with the tokens of prefix"""
+		ids = self.vocab.lookup(prefix.lower().split())
+		lo, hi = self.ng_trie.prefix_range(ids, n) if ids is not None and len(ids) <= n else (0, 0)
+		return NgramCounts(self.ng_stores[n-1], self.vocab, lo, hi)
+
+	def next_token_distribution(self, context):
+		"""{token: probability} after the longest suffix of context that occurs in the corpus followed by a token"""
+		tokens = context.lower().split()
+		ids = []
+		for token in reversed(tokens):
+			if token not in self.vocab:
+				break
+			ids.insert(0, self.vocab.token_ids[token])
+		length = self.ng_trie.longest_context(ids)
+		return self.get_ngram_model(length + 1)[' '.join(tokens[len(tokens)-length:])]
+
 	def populate_ngrams(self):
-		for n in range(1, self.max_ng_size+1):
-			print('building {}-gram models...'.format(n))
-			counts = ngram_counts_for_lines(self.lines, n)
-			rates = normalize(counts)
-			model = model_from_counts(counts, n)
-			self.ng_counts.append(counts)
-			self.ng_rates.append(rates)
-			self.ng_models.append(model)
+		size = self.max_ng_size
+		self.ng_stores = LazyList(size, self.build_store)		# sorted token id rows and their counts, by size
+		self.ng_counts = LazyList(size, lambda i: NgramCounts(self.ng_stores[i], self.vocab))	# ngram counts by size
+		self.ng_rates = LazyList(size, lambda i: NgramRates(self.ng_stores[i], self.vocab))		# ngram rates by size
+		self.ng_trie = NgramTrie(self.ng_stores)		# all orders, for prefix and longest-context queries
+		self.ng_models = LazyList(size, lambda i: ConditionalModel(self.ng_trie, i + 1, self.vocab))	# P(last token | all preceding tokens)
+		self.kneser_ney = KneserNey(self.ng_stores, self.stream, self.line_bounds)
+
+	def build_store(self, i):
+		n = i + 1
+		counts = self.order_counts[i]
+		with span('{}-gram store'.format(n)) as s:
+			store = NgramStore(counts.rows, counts.counts, self.sketches[n].total if n in self.sketches else None)
+			s.record(ngrams=len(store), occurrences=int(store.total))
+		return store
+
+	@property
+	def unigram_counts_by_id(self):
+		return self.unigram_tables[0]
+
+	@property
+	def unigram_log_probs(self):
+		return self.unigram_tables[1]
+
+	@property
+	def unigram_tables(self):
+		"""unigram counts and log P(token), by token id"""
+		if self._unigram_tables is None:
+			unigrams = self.ng_stores[0]
+			with span('token tables'):
+				counts_by_id = np.zeros(len(self.vocab), dtype=np.int64)
+				counts_by_id[unigrams.rows[:, 0]] = unigrams.counts
+				log_probs = np.full(len(self.vocab), -np.inf)
+				log_probs[unigrams.rows[:, 0]] = np.log(unigrams.counts) - np.log(unigrams.total)
+			self._unigram_tables = counts_by_id, log_probs
+		return self._unigram_tables
+
+	@property
+	def bigram_log_probs(self):
+		"""log P(w2|w1) aligned with the rows of the bigram store, or None for a unigram model"""
+		if self._bigram_log_probs is None and self.max_ng_size >= 2:
+			bigrams = self.ng_stores[1]
+			with span('bigram log probs'):
+				bounds = bigrams.context_bounds()
+				context_totals = np.repeat(np.add.reduceat(bigrams.counts, bounds[:-1]), np.diff(bounds))
+				self._bigram_log_probs = np.log(bigrams.counts) - np.log(context_totals)
+		return self._bigram_log_probs
 
 	def populate_tfidf(self):
-		for n in range(1, self.max_ng_size+1):
-			print('tfidf {}-grams...'.format(n))
-			tf, df, tfidf = tf_idf(self.lines_by_doc, n, 1)
-			self.tf_dicts.append(tf)
-			self.df_dicts.append(df)
-			self.tfidf_dicts.append(tfidf)
+		size = self.max_ng_size
+		self.tfidf_matrices = LazyList(size, self.build_tfidf_matrix)		# sparse documents x ngrams tfidf, by size
+		self.tf_dicts = LazyList(size, lambda i: document_views(self.ng_stores[i], self.vocab, self.order_counts[i].tf_indptr,
+										self.order_counts[i].tf_indices, self.order_counts[i].tf_values))	# term frequency
+		self.df_dicts = LazyList(size, lambda i: NgramValues(self.ng_stores[i], self.vocab, self.order_counts[i].doc_freqs))	# doc frequency
+		self.tfidf_dicts = LazyList(size, lambda i: document_views(self.ng_stores[i], self.vocab, self.tfidf_matrices[i].indptr,
+										self.tfidf_matrices[i].indices, self.tfidf_matrices[i].data))	# the matrices as {ngram: tfidf} per document
+
+	def build_tfidf_matrix(self, i):
+		counts = self.order_counts[i]
+		with span('tfidf {}-grams'.format(i + 1)) as s:
+			matrix = TfidfMatrix(counts, min_doc_freq_threshold=1)
+			s.record(documents=matrix.num_docs, entries=len(matrix.data))
+		return matrix
 
 	def ngram_likelihood(self, line, n):
-		likelihood = 1
-		tokens = line.split()
-		for ngram in split_ngrams_for_sequence(tokens, n):
-			pass
-			# TODO: complete
+		log_probs, __ = self.score_lines([line], n)
+		return float(np.exp(log_probs[0]))
+
+	def score_lines(self, lines, n=None):
+		"""
+		(log probability, perplexity) arrays for a batch of lines under the
+		interpolated Kneser-Ney model of order n (default: the largest)
+		"""
+		n = self.max_ng_size if n is None else n
+		ids, line_bounds = encode_batch(lines, self.vocab)
+		token_log_probs = self.kneser_ney.log_probs(ids, line_bounds, n)
+		lengths = np.diff(line_bounds)
+		log_probs = np.bincount(np.repeat(np.arange(len(lengths)), lengths), weights=token_log_probs, minlength=len(lengths))
+		return log_probs, np.exp(-log_probs / np.maximum(lengths, 1))
 
 	def unigram_likelihood(self, line):
 		likelihood = 1
+		unigram_model = self.get_ngram_rates(1)
 		for token in line.split():
-			unigram_model = self.get_ngram_rates(1)
 			if token in unigram_model:
 				likelihood *= unigram_model[token]
 			else:
@@ -89,38 +527,105 @@ class NgramModel(object):
 		return likelihood
 
 	def build_collocates_from_mask(self, mask, min_doc_freq_threshold=10):
+		"""collocate counts for every target in the corpus, {target: {token: count}}"""
+		target_start, target_end = mask_target_bounds(mask)
+		starts = window_starts(self.line_bounds, len(mask))
+		targets = ngram_id_rows(self.stream, starts + target_start, target_end - target_start)
 		d = {}
-		target_start = mask.index('X')
-		target_end = len(mask) - mask[::-1].index('X')
-		for line in self.lines:
-			ngrams = ngrams_for_line(line, len(mask))
-			for ngram in ngrams:
-				tokens = ngram.split()
-				key = " ".join(tokens[target_start:target_end])
-				for mask_value, token in zip(mask, tokens):
-					unigram_counts = self.get_ngram_counts(1)
-					if mask_value is True and unigram_counts[token] >= min_doc_freq_threshold:
-						enter_nested_item(d, key, token, 1)
+		with span('collocates', windows=len(starts)):
+			for target_ids, token_id, count in self.count_mask_tokens(mask, starts, targets, min_doc_freq_threshold):
+				enter_nested_item(d, ' '.join(self.vocab.decode(target_ids)), self.vocab.tokens[token_id], count)
 		return d
 
-	def ngrams_by_unigram_and_bigram_surprise(self, n, min_count_threshold, min_doc_freq_threshold):
-		counts = self.ng_counts[n-1]
-		rates = self.ng_rates[n-1]
-		doc_freqs = self.df_dicts[n-1]
-
-		common_rates = {ng: rate for ng, rate in rates.items()
-						if doc_freqs[ng] > min_doc_freq_threshold 
-						and counts[ng] >= min_count_threshold}
+	def collocates_for_term(self, mask, term, min_doc_freq_threshold=10):
+		"""
+		{token: count} of the collocates of one target term or phrase, found through
+		the positional index instead of a corpus pass
+		"""
+		target_start, target_end = mask_target_bounds(mask)
+		target_ids = self.vocab.lookup(term.lower().split())
+		if target_ids is None or len(target_ids) != target_end - target_start:
+			return {}
+		starts = self.positional_index.phrase_windows(target_ids, target_start, len(mask))
+		targets = np.zeros((len(starts), 0), dtype=np.int32)
+		return {self.vocab.tokens[token_id]: count for __, token_id, count
+				in self.count_mask_tokens(mask, starts, targets, min_doc_freq_threshold)}
 
-		by_unigram_likelihood = {ng: self.unigram_likelihood(ng) for ng in rates}
-		by_bigram_likelihood = {ng: self.bigram_likelihood(ng) for ng in counts}
-		by_unigram_surprise = keywise_quotients(common_rates, by_unigram_likelihood)
-		by_bigram_surprise = keywise_quotients(common_rates, by_bigram_likelihood)
+	def count_mask_tokens(self, mask, starts, targets, min_doc_freq_threshold):
+		"""
+		(target ids, token id, count) for the tokens at the mask's `1` positions of the
+		windows at `starts`, grouped by each window's row of `targets`
+		"""
+		groups = []
+		for i, mask_value in enumerate(mask):
+			if mask_value is True:
+				tokens = self.stream[starts + i]
+				common = self.unigram_counts_by_id[tokens] >= min_doc_freq_threshold
+				groups.append(np.column_stack([targets[common], tokens[common]]))
+		if not groups:
+			return []
+		width = targets.shape[1] + 1
+		keys, counts = np.unique(row_keys(np.concatenate(groups).reshape(-1, width)), return_counts=True)
+		rows = rows_from_keys(keys, width).tolist()
+		return [(row[:-1], row[-1], count) for row, count in zip(rows, counts.tolist())]
 
+	def ngrams_by_unigram_and_bigram_surprise(self, n, min_count_threshold, min_doc_freq_threshold):
+		indices, log_unigram_surprise, log_bigram_surprise = self.log_surprise(n, min_count_threshold, min_doc_freq_threshold)
+		ngrams = self.ngram_strings(n, indices)
+		by_unigram_surprise = dict(zip(ngrams, np.exp(log_unigram_surprise).tolist()))
+		by_bigram_surprise = dict(zip(ngrams, np.exp(log_bigram_surprise).tolist()))
 		return by_unigram_surprise, by_bigram_surprise
 
+	def top_ngrams_by_surprise(self, n, min_count_threshold, min_doc_freq_threshold, k=20):
+		"""the k most surprising ngrams under the unigram and bigram models, as ranked [(ngram, surprise)] lists"""
+		indices, log_unigram_surprise, log_bigram_surprise = self.log_surprise(n, min_count_threshold, min_doc_freq_threshold)
+		rankings = []
+		for log_surprise in (log_unigram_surprise, log_bigram_surprise):
+			top = np.argsort(-log_surprise, kind='stable')[:k]
+			rankings.append(list(zip(self.ngram_strings(n, indices[top]), np.exp(log_surprise[top]).tolist())))
+		return rankings
+
+	def log_surprise(self, n, min_count_threshold, min_doc_freq_threshold):
+		"""
+		Store indices of the ngrams of size n passing both thresholds, with the log of
+		their observed rate over their likelihood under the unigram and bigram models.
+		Ngrams are filtered before anything is scored.
+		"""
+		store = self.ng_stores[n-1]
+		indices = np.flatnonzero((self.order_counts[n-1].doc_freqs > min_doc_freq_threshold)
+									& (store.counts >= min_count_threshold))
+		rows = store.rows[indices].astype(np.int64)
+		log_rates = np.log(store.counts[indices]) - np.log(store.total)
+		log_unigram_likelihood = self.unigram_log_probs[rows].sum(axis=1)
+		log_bigram_likelihood = self.unigram_log_probs[rows[:, 0]]
+		if n > 1:
+			pairs = np.stack([rows[:, :-1], rows[:, 1:]], axis=2).reshape(-1, 2)
+			pair_log_probs = self.bigram_log_probs[self.ng_stores[1].find(pairs)].reshape(len(rows), n-1)
+			log_bigram_likelihood = log_bigram_likelihood + pair_log_probs.sum(axis=1)
+		return indices, log_rates - log_unigram_likelihood, log_rates - log_bigram_likelihood
 
+	def ngram_strings(self, n, indices):
+		return [' '.join(self.vocab.decode(row)) for row in self.ng_stores[n-1].rows[indices].tolist()]
 
+def encode_line_text(lines_by_doc):
+	"""(UTF-8 bytes, character offsets) of all the lines of all the documents, one after another"""
+	lines = [line for lines in lines_by_doc for line in lines]
+	offsets = np.concatenate([[0], np.cumsum([len(line) for line in lines], dtype=np.int64)]).astype(np.int64)
+	return np.frombuffer(''.join(lines).encode('utf-8'), dtype=np.uint8), offsets
 
+def decode_line_text(data, offsets, doc_bounds):
+	"""the lines of each document from encode_line_text's arrays, with one decode of the whole text"""
+	text = data.tobytes().decode('utf-8')
+	offsets = offsets.tolist()
+	lines = [text[lo:hi] for lo, hi in zip(offsets[:-1], offsets[1:])]
+	doc_bounds = doc_bounds.tolist()
+	return [lines[lo:hi] for lo, hi in zip(doc_bounds[:-1], doc_bounds[1:])]
 
+def concatenate_bounds(bounds_list):
+	"""bounds arrays (each starting at 0) of consecutive pieces, as one bounds array"""
+	offsets = np.cumsum([0] + [bounds[-1] for bounds in bounds_list[:-1]]).tolist()
+	return np.concatenate([bounds_list[0][:1]] + [bounds[1:] + offset for bounds, offset in zip(bounds_list, offsets)])
 
+def mask_target_bounds(mask):
+	"""[start, end) of the span from the first to the last 'X' of a mask"""
+	return mask.index('X'), len(mask) - mask[::-1].index('X')
@@ -0,0 +1,234 @@
+from collections.abc import Mapping, ItemsView, ValuesView
+
+import numpy as np
+
+from utilities.ngram_utils import (
+	KEY_DTYPE,
+	row_keys,
+	rows_from_keys
+)
+
+"""
+Compact storage for ngram counts. Each ngram order is held as a lexicographically
+sorted array of fixed-width token id rows, so lookups are binary searches and the
+ngrams sharing a context are contiguous. The Mapping views at the bottom present a
+store with the same keys and values as the old string-keyed dicts.
+"""
+
+MAX_ID = np.iinfo(KEY_DTYPE).max
+
+class NgramStore(object):
+
+	def __init__(self, rows, counts, total=None):
+		"""
+		rows: sorted, distinct (k, n) token ids; counts: (k,) occurrences
+		total: number of ngram occurrences in the corpus, if the rows are not all of them
+		"""
+		self.rows = np.ascontiguousarray(rows, dtype=KEY_DTYPE)
+		self.counts = counts
+		self.n = self.rows.shape[1]
+		self.keys = row_keys(self.rows)
+		self.total = int(counts.sum()) if total is None else total
+
+	@classmethod
+	def from_rows(cls, rows, n):
+		"""count the distinct rows of an (m, n) array of ngram ids"""
+		keys, counts = np.unique(row_keys(rows.reshape(-1, n)), return_counts=True)
+		return cls(rows_from_keys(keys, n), counts.astype(np.int64))
+
+	def __len__(self):
+		return len(self.counts)
+
+	def find(self, rows):
+		"""index of each row of ids in the store, or -1 where absent"""
+		keys = row_keys(rows.reshape(-1, self.n))
+		if len(self) == 0:
+			return np.full(len(keys), -1)
+		idx = np.minimum(np.searchsorted(self.keys, keys), len(self) - 1)
+		return np.where(self.keys[idx] == keys, idx, -1)
+
+	def index(self, ids):
+		"""index of one ngram given as a list of ids, or -1"""
+		if ids is None or len(ids) != self.n:
+			return -1
+		return int(self.find(np.array([ids]))[0])
+
+	def prefix_range(self, prefix):
+		"""[lo, hi) bounds of the rows starting with the given ids"""
+		pad = self.n - len(prefix)
+		lo, hi = row_keys(np.array([list(prefix) + [0] * pad, list(prefix) + [MAX_ID] * pad]))
+		return int(np.searchsorted(self.keys, lo)), int(np.searchsorted(self.keys, hi, side='right'))
+
+	def context_bounds(self):
+		"""start of each run of rows sharing their first n-1 ids, plus len(self)"""
+		contexts = self.rows[:, :-1]
+		changes = np.flatnonzero((contexts[1:] != contexts[:-1]).any(axis=1)) + 1
+		return np.concatenate([[0], changes, [len(self)]]) if len(self) else np.array([0])
+
+### DICT-COMPATIBLE VIEWS ###
+
+class _ItemsView(ItemsView):
+	def __iter__(self):
+		return self._mapping._iter_items()
+
+class _ValuesView(ValuesView):
+	def __iter__(self):
+		return (v for k, v in self._mapping._iter_items())
+
+class StoreView(Mapping):
+	"""Read-only {ngram string: value} view over rows [lo, hi) of a store"""
+
+	def __init__(self, store, vocab, lo=0, hi=None):
+		self.store = store
+		self.vocab = vocab
+		self.lo = lo
+		self.hi = len(store) if hi is None else hi
+
+	def value(self, i):
+		raise NotImplementedError
+
+	def key(self, row):
+		return ' '.join(self.vocab.decode(row))
+
+	def __getitem__(self, ngram):
+		i = self.store.index(self.vocab.lookup(ngram.split()))
+		if not self.lo <= i < self.hi:
+			raise KeyError(ngram)
+		return self.value(i)
+
+	def __iter__(self):
+		return (self.key(row) for row in self.store.rows[self.lo:self.hi].tolist())
+
+	def __len__(self):
+		return self.hi - self.lo
+
+	def _iter_items(self):
+		for i, row in enumerate(self.store.rows[self.lo:self.hi].tolist(), self.lo):
+			yield self.key(row), self.value(i)
+
+	def items(self):
+		return _ItemsView(self)
+
+	def values(self):
+		return _ValuesView(self)
+
+class NgramCounts(StoreView):
+	def value(self, i):
+		return int(self.store.counts[i])
+
+class NgramValues(StoreView):
+	"""view of an array of values aligned with the store's rows"""
+
+	def __init__(self, store, vocab, values):
+		super().__init__(store, vocab)
+		self.values_array = values
+
+	def value(self, i):
+		return self.values_array[i].item()
+
+class NgramRates(StoreView):
+	def value(self, i):
+		return int(self.store.counts[i]) / self.store.total
+
+class ContextDistribution(StoreView):
+	"""P(last token | context) for the children [lo, hi) of one trie node, keyed by last token"""
+
+	def __init__(self, trie, n, vocab, lo, hi):
+		super().__init__(trie.stores[n-1], vocab, lo, hi)
+		self.ids = trie.ids[n-1]
+		self._context_total = None
+
+	@property
+	def context_total(self):
+		if self._context_total is None:
+			self._context_total = int(self.store.counts[self.lo:self.hi].sum())
+		return self._context_total
+
+	def key(self, row):
+		return self.vocab.tokens[row[-1]]
+
+	def value(self, i):
+		return int(self.store.counts[i]) / self.context_total
+
+	def __getitem__(self, token):
+		token_id = self.vocab.token_ids.get(token)
+		i = self.lo + int(np.searchsorted(self.ids[self.lo:self.hi], token_id)) if token_id is not None else self.hi
+		if i == self.hi or self.ids[i] != token_id:
+			raise KeyError(token)
+		return self.value(i)
+
+class ConditionalModel(Mapping):
+	"""Read-only {context string: {next token: probability}} view of level n of a trie"""
+
+	def __init__(self, trie, n, vocab):
+		self.trie = trie
+		self.n = n
+		self.vocab = vocab
+		self._contexts = None
+
+	@property
+	def contexts(self):
+		"""indices of the level n-1 nodes that have children"""
+		if self._contexts is None:
+			if self.n == 1:
+				self._contexts = np.arange(1 if len(self.trie.stores[0]) else 0)
+			else:
+				self._contexts = np.flatnonzero(np.diff(self.trie.child_ptr[self.n-2]))
+		return self._contexts
+
+	def __getitem__(self, context):
+		ids = self.vocab.lookup(context.split())
+		i = self.trie.find(ids) if ids is not None and len(ids) == self.n - 1 else -1
+		lo, hi = self.trie.children(self.n - 1, i, i+1) if i >= 0 else (0, 0)
+		if lo == hi:
+			raise KeyError(context)
+		return ContextDistribution(self.trie, self.n, self.vocab, lo, hi)
+
+	def __iter__(self):
+		if self.n == 1:
+			yield from [''] * len(self.contexts)
+			return
+		rows = self.trie.stores[self.n-2].rows
+		for i in self.contexts.tolist():
+			yield ' '.join(self.vocab.decode(rows[i].tolist()))
+
+	def __len__(self):
+		return len(self.contexts)
+
+class DocumentTerms(Mapping):
+	"""Read-only {ngram string: value} view of one document's sparse row"""
+
+	def __init__(self, store, vocab, indices, values):
+		self.store = store
+		self.vocab = vocab
+		self.indices = indices		# sorted store indices of the document's ngrams
+		self.values_array = values
+
+	def position(self, ngram):
+		i = self.store.index(self.vocab.lookup(ngram.split()))
+		j = int(np.searchsorted(self.indices, i))
+		if i < 0 or j == len(self.indices) or self.indices[j] != i:
+			raise KeyError(ngram)
+		return j
+
+	def __getitem__(self, ngram):
+		return self.values_array[self.position(ngram)].item()
+
+	def __iter__(self):
+		return (' '.join(self.vocab.decode(row)) for row in self.store.rows[self.indices].tolist())
+
+	def __len__(self):
+		return len(self.indices)
+
+	def _iter_items(self):
+		return zip(self, self.values_array.tolist())
+
+	def items(self):
+		return _ItemsView(self)
+
+	def values(self):
+		return _ValuesView(self)
+
+def document_views(store, vocab, indptr, indices, values):
+	"""one DocumentTerms per row of a CSR matrix over the store's ngrams"""
+	return [DocumentTerms(store, vocab, indices[lo:hi], values[lo:hi]) for lo, hi in zip(indptr[:-1], indptr[1:])]
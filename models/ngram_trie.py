@@ -0,0 +1,86 @@
+import numpy as np
+
+from utilities.lazy_list import LazyList
+from utilities.instrumentation import span
+
+"""
+All ngram orders of a model as one trie. Level k holds the k-grams in the order
+of the k-gram store, so a node is identified by its store index: its count is
+the store's count, its children are the slice child_ptr[k][i]:child_ptr[k][i+1]
+of level k+1, sorted by token id, and the descendants of any contiguous run of
+nodes are again contiguous. Beyond the stores, a node costs its last token id
+and one child pointer. Levels are built on first use, so queries that stop at
+level n read only the stores up to n.
+"""
+
+class NgramTrie(object):
+
+	def __init__(self, stores):
+		"""stores: the store of each order, as a list or a LazyList"""
+		self.stores = stores
+		self.ids = LazyList(len(stores), self.level_ids)
+		self.child_ptr = LazyList(len(stores) - 1, self.link_level)
+
+	def level_ids(self, k):
+		"""last token id of each (k+1)-gram"""
+		with span('trie {}-gram ids'.format(k + 1)):
+			return np.ascontiguousarray(self.stores[k].rows[:, -1], dtype=np.uint32)
+
+	def link_level(self, k):
+		"""child pointers from the (k+1)-grams to the (k+2)-grams"""
+		store, longer = self.stores[k], self.stores[k+1]
+		with span('trie {}-gram links'.format(k + 1)) as s:
+			parents = store.find(longer.rows[:, :-1])	# every prefix of a kept ngram is kept, so none is -1
+			s.record(nodes=len(longer))
+			return np.searchsorted(parents, np.arange(len(store) + 1))
+
+	@property
+	def depth(self):
+		return len(self.stores)
+
+	def children(self, k, lo, hi):
+		"""[lo, hi) at level k+1 of the children of nodes [lo, hi) at level k; level 0 is the root"""
+		if k == 0:
+			return 0, len(self.stores[0])
+		if k == self.depth:
+			return 0, 0
+		return int(self.child_ptr[k-1][lo]), int(self.child_ptr[k-1][hi])
+
+	def child(self, k, i, token_id):
+		"""index at level k+1 of the child of node i for token_id, or -1"""
+		lo, hi = self.children(k, i, i+1)
+		j = lo + int(np.searchsorted(self.ids[k][lo:hi], token_id))
+		return j if j < hi and self.ids[k][j] == token_id else -1
+
+	def find(self, ids):
+		"""store index of an ngram given as token ids, or -1; one binary search per token"""
+		i = 0
+		for k, token_id in enumerate(ids):
+			i = self.child(k, i, token_id)
+			if i < 0:
+				return -1
+		return i
+
+	def count(self, ids):
+		i = self.find(ids) if ids else -1
+		return int(self.stores[len(ids)-1].counts[i]) if i >= 0 else 0
+
+	def prefix_range(self, prefix, n):
+		"""[lo, hi) of the ngrams of size n starting with prefix, in the size n store"""
+		i = self.find(prefix)
+		if i < 0:
+			return 0, 0
+		lo, hi = i, i + 1
+		for k in range(len(prefix), n):
+			lo, hi = self.children(k, lo, hi)
+		return lo, hi
+
+	def longest_context(self, context):
+		"""length of the longest suffix of context that is followed by some token in the corpus"""
+		for length in range(min(len(context), self.depth - 1), 0, -1):
+			i = self.find(context[len(context)-length:])
+			if i >= 0:
+				lo, hi = self.children(length, i, i+1)
+				if hi > lo:
+					return length
+		return 0
@@ -0,0 +1,109 @@
+import json
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from models.ngram_model import NgramModel
+
+"""
+One model for many worker processes. export_model copies a built model's flat
+arrays (stream and bounds, line text, every order's counts and term
+frequencies, the TF-IDF matrices) and, as JSON, its vocabulary, urls and tags into a single
+multiprocessing.shared_memory block. A worker given the export's handle attaches
+with SharedNgramModel.attach: the arrays are read-only views into the block, not
+copies, so N workers cost about one model's arrays plus their own vocabulary
+dict and whatever they build on top (tries, Kneser-Ney tables, event counts,
+the lines once decoded).
+
+	with export_model(model) as export:
+		with Pool(4, initializer=init, initargs=(export.handle,)) as pool:
+			...
+
+	def init(handle):
+		global model
+		model = SharedNgramModel.attach(handle)
+
+The block lives until the export is closed, so close it only after the workers
+are done. Workers should be started by the exporting process (multiprocessing
+pools are), which shares its resource tracker with them.
+"""
+
+ALIGNMENT = 64		# bytes; each array starts on a cache line
+
+class SharedModelHandle(object):
+	"""what a worker needs to attach: the block's name and where each array lies in it"""
+
+	def __init__(self, name, layout):
+		self.name = name
+		self.layout = layout		# {array name: (offset, dtype string, shape)}
+
+class SharedModelExport(object):
+
+	def __init__(self, block, handle):
+		self.block = block
+		self.handle = handle
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	@property
+	def size(self):
+		return self.block.size
+
+	def close(self):
+		"""frees the block; models attached to it must not be used afterwards"""
+		if self.block is not None:
+			self.block.close()
+			self.block.unlink()
+			self.block = None
+
+def export_model(model, name=None):
+	"""
+	A SharedModelExport holding the model's arrays, lines and TF-IDF matrices,
+	all orders counted and built first
+	"""
+	arrays, objects = model.snapshot_arrays(tfidf=True)
+	arrays = dict(arrays, objects=np.frombuffer(json.dumps(objects).encode('utf-8'), dtype=np.uint8))
+	layout, size = {}, 0
+	for key, array in arrays.items():
+		array = np.asarray(array)
+		layout[key] = (size, array.dtype.str, array.shape)
+		size += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+	block = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+	for key, array in arrays.items():
+		offset, dtype, shape = layout[key]
+		np.ndarray(shape, dtype, buffer=block.buf, offset=offset)[...] = array
+	return SharedModelExport(block, SharedModelHandle(block.name, layout))
+
+def attach_arrays(handle):
+	"""(block, {name: read-only array view into the block})"""
+	block = shared_memory.SharedMemory(name=handle.name)
+	arrays = {}
+	for key, (offset, dtype, shape) in handle.layout.items():
+		array = np.ndarray(shape, dtype, buffer=block.buf, offset=offset)
+		array.flags.writeable = False
+		arrays[key] = array
+	return block, arrays
+
+class SharedNgramModel(NgramModel):
+	"""
+	A read-only NgramModel over an export's block: every query works, while
+	adding or removing documents, which would rewrite the shared counts, raises.
+	"""
+
+	@classmethod
+	def attach(cls, handle):
+		block, arrays = attach_arrays(handle)
+		objects = json.loads(arrays.pop('objects').tobytes())
+		model = cls.from_arrays(arrays, objects)
+		model.block = block		# kept open as long as the model
+		return model
+
+	def add_documents(self, df_rows):
+		raise TypeError('a shared model is read-only; add documents to the exported model and export it again')
+
+	def remove_documents(self, urls):
+		raise TypeError('a shared model is read-only; remove documents from the exported model and export it again')
@@ -0,0 +1,155 @@
+import math
+
+import numpy as np
+
+from utilities.ngram_utils import (
+	window_starts,
+	window_docs,
+	ngram_id_rows,
+	count_ngram_order,
+	row_keys,
+	rows_from_keys,
+	order_counts_from_pairs
+)
+
+"""
+Count-Min Sketch over rows of token ids, for pruning rare high-order ngrams
+before they are counted exactly. Updates are conservative: an ngram raises its
+buckets only as far as its own new estimate, which leaves far fewer rare ngrams
+looking frequent than adding to every bucket. Estimates never undercount (up to
+the counters' ceiling); with width = ceil(e / epsilon) and
+depth = ceil(ln(1 / delta)), an estimate exceeds the true count by more than
+epsilon * total with probability at most delta.
+"""
+
+FNV_PRIME = np.uint64(1099511628211)
+FNV_OFFSET = np.uint64(14695981039346656037)
+
+def hash_rows(rows):
+	"""one 64-bit FNV-1a style hash per row of token ids"""
+	h = np.full(len(rows), FNV_OFFSET, dtype=np.uint64)
+	with np.errstate(over='ignore'):
+		for j in range(rows.shape[1]):
+			h = (h ^ rows[:, j].astype(np.uint64)) * FNV_PRIME
+	return h
+
+class CountMinSketch(object):
+
+	def __init__(self, width, depth, seed=0, table=None, total=0, dtype=np.uint32):
+		"""
+		dtype: of the counters, which saturate at its maximum, so an estimate at the
+		maximum means at least that many; a small one suffices for pruning
+		total: number of rows added, as the table's sums no longer give it
+		"""
+		self.width = width
+		self.depth = depth
+		self.seed = seed
+		rng = np.random.RandomState(seed)
+		self.multipliers = rng.randint(1, 2**62, size=depth, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+		self.table = np.zeros((depth, width), dtype=dtype) if table is None else table
+		self.max_count = int(np.iinfo(self.table.dtype).max)
+		self.total = total
+
+	@classmethod
+	def from_error_bounds(cls, epsilon, delta, seed=0, dtype=np.uint32):
+		return cls(int(math.ceil(math.e / epsilon)), int(math.ceil(math.log(1 / delta))), seed, dtype=dtype)
+
+	@property
+	def epsilon(self):
+		return math.e / self.width
+
+	def error_bound(self):
+		"""estimates overshoot by at most this much, with probability 1 - delta"""
+		return self.epsilon * self.total
+
+	def buckets(self, hashes):
+		"""(depth, len(hashes)) bucket of each hash in each row of the table"""
+		with np.errstate(over='ignore'):
+			mixed = hashes[None, :] * self.multipliers[:, None]
+		return ((mixed >> np.uint64(32)) % np.uint64(self.width)).astype(np.int64)
+
+	def add(self, hashes):
+		"""conservative update with a batch of hashes: each distinct hash lifts its buckets to its estimate plus its count"""
+		distinct, counts = np.unique(hashes, return_counts=True)
+		buckets = self.buckets(distinct)
+		targets = np.minimum(self.bucket_minimum(buckets) + counts, self.max_count).astype(self.table.dtype)
+		for d in range(self.depth):
+			np.maximum.at(self.table[d], buckets[d], targets)
+		self.total += len(hashes)
+
+	def estimate(self, hashes):
+		return self.bucket_minimum(self.buckets(hashes))
+
+	def bucket_minimum(self, buckets):
+		return np.min([self.table[d][buckets[d]] for d in range(self.depth)], axis=0).astype(np.int64)
+
+### HEAVY HITTERS ###
+
+class HeavyHitterCounting(object):
+	"""
+	Settings for counting ngram orders >= from_order approximately: only ngrams
+	occurring at least min_count times are kept (with exact counts), and a
+	Count-Min Sketch estimates the rest. Singling out ngrams seen min_count times
+	among mostly unique ones takes about one bucket per window, so by default
+	each order's sketch has buckets_per_window * windows / min_count buckets per
+	row, of one byte each; an epsilon fixes the width instead, which only prunes
+	while epsilon * windows stays below min_count.
+	"""
+
+	def __init__(self, from_order=5, min_count=2, buckets_per_window=2.0, delta=0.05, epsilon=None, seed=0):
+		self.from_order = from_order
+		self.min_count = min_count
+		self.buckets_per_window = buckets_per_window
+		self.delta = delta
+		self.epsilon = epsilon
+		self.seed = seed
+
+	def __repr__(self):
+		return 'HeavyHitterCounting({from_order}, {min_count}, {buckets_per_window}, {delta}, {epsilon}, {seed})'.format(**vars(self))
+
+	def applies_to(self, n):
+		return n >= self.from_order
+
+	def new_sketch(self, num_windows):
+		dtype = np.uint8 if self.min_count < 255 else np.uint32		# counts past min_count only need to stay past it
+		if self.epsilon is not None:
+			return CountMinSketch.from_error_bounds(self.epsilon, self.delta, self.seed, dtype)
+		width = max(int(math.ceil(self.buckets_per_window * num_windows / self.min_count)), 1)
+		return CountMinSketch(width, int(math.ceil(math.log(1 / self.delta))), self.seed, dtype=dtype)
+
+def count_heavy_ngram_order(stream, line_bounds, doc_bounds, n, sketch, min_count, chunk_tokens=1 << 20):
+	"""
+	OrderCounts holding only the ngrams of size n that occur at least min_count
+	times, found in two passes over chunks of about chunk_tokens tokens: the first
+	fills the sketch, the second keeps the windows whose estimate reaches
+	min_count and counts them exactly. Memory is the sketch (a few bytes per
+	window, see HeavyHitterCounting), one chunk and the surviving candidates.
+	"""
+	for starts in chunked_window_starts(line_bounds, n, chunk_tokens):
+		sketch.add(hash_rows(ngram_id_rows(stream, starts, n)))
+	pair_keys, pair_counts = [], []
+	for starts in chunked_window_starts(line_bounds, n, chunk_tokens):
+		rows = ngram_id_rows(stream, starts, n)
+		heavy = sketch.estimate(hash_rows(rows)) >= min_count
+		doc_rows = np.column_stack([window_docs(line_bounds, doc_bounds, starts[heavy]), rows[heavy]])
+		keys, counts = np.unique(row_keys(doc_rows), return_counts=True)
+		pair_keys.append(keys)
+		pair_counts.append(counts)
+	if not pair_keys:
+		return count_ngram_order(stream, line_bounds, doc_bounds, n)
+	keys, inverse = np.unique(np.concatenate(pair_keys), return_inverse=True)
+	tf_values = np.bincount(inverse.ravel(), weights=np.concatenate(pair_counts)).astype(np.int64)
+	pairs = rows_from_keys(keys, n+1)
+	order = order_counts_from_pairs(pairs, tf_values, len(doc_bounds) - 1)
+	frequent = (order.counts >= min_count)[order.tf_indices]	# drop the sketch's false positives
+	return order_counts_from_pairs(pairs[frequent], tf_values[frequent], len(doc_bounds) - 1)
+
+def chunked_window_starts(line_bounds, n, chunk_tokens):
+	"""window_starts, a run of whole lines of about chunk_tokens tokens at a time"""
+	num_lines = len(line_bounds) - 1
+	lo = 0
+	while lo < num_lines:
+		hi = max(int(np.searchsorted(line_bounds, line_bounds[lo] + chunk_tokens, side='right')) - 1, lo + 1)
+		hi = min(hi, num_lines)
+		yield window_starts(line_bounds[lo:hi+1], n)
+		lo = hi
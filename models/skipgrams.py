@@ -1,10 +1,18 @@
 import sys
 sys.path.append('.')
+import itertools
+from collections.abc import Mapping
 
+import numpy as np
+
+from utilities.vocabulary import Vocabulary
 from utilities.ngram_utils import (
 	ngrams_for_line,
 	ngram_counts_for_line,
-	ngram_counts_for_lines
+	encode_lines,
+	window_starts,
+	ngram_id_rows,
+	row_keys
 )
 from utilities.dictionary import(
 	top_n,
@@ -12,19 +20,139 @@ from utilities.dictionary import(
 	sum_counters,
 	enter_item
 )
+from models.ngram_store import NgramStore
 
 MASK_TOKEN = '____'
 
 def build_skipgram_tree(mask, lines):
-	ngram_size = len(mask)
-	ngram_counts = ngram_counts_for_lines(lines, ngram_size)
-	skipgram_tree = {}
-	for ngram, count in ngram_counts.items():
-		skipgram = apply_mask_to_ngram(mask, ngram)
-		if not skipgram in skipgram_tree:
-			skipgram_tree[skipgram] = {}
-		skipgram_tree[skipgram][ngram] = count
-	return skipgram_tree
+	"""{skipgram: {ngram: count}} for one mask; SkipgramIndex serves every mask of a width at once"""
+	return SkipgramIndex.from_lines(lines, len(mask), [mask]).tree(mask)
+
+### SKIPGRAM INDEX ###
+
+def all_masks(width):
+	"""every mask of the width with at least one visible and one hidden position"""
+	return [mask for mask in itertools.product((True, False), repeat=width) if any(mask) and not all(mask)]
+
+def normalize_mask(mask):
+	"""visibility tuple of a mask; like apply_mask_element, any truthy value (True, 'X') is visible"""
+	return tuple(bool(visibility) for visibility in mask)
+
+class MaskGroups(object):
+	"""
+	The ngrams of a store ordered by their visible tokens under one mask, then by
+	their hidden ones: each skipgram's fillers are the run order[bounds[g]:bounds[g+1]]
+	"""
+
+	def __init__(self, rows, mask):
+		self.visible = [i for i, visibility in enumerate(mask) if visibility]
+		self.hidden = [i for i, visibility in enumerate(mask) if not visibility]
+		self.order = np.lexsort([rows[:, i] for i in reversed(self.visible + self.hidden)])
+		keys = row_keys(rows[self.order][:, self.visible])
+		changes = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+		self.bounds = np.concatenate([[0], changes, [len(keys)]]) if len(keys) else np.array([0])
+		self.keys = keys[self.bounds[:-1]]
+
+	def group(self, visible_ids):
+		"""index of the skipgram with these visible ids, or -1"""
+		key = row_keys(np.array([visible_ids]))
+		g = int(np.searchsorted(self.keys, key[0]))
+		return g if g < len(self.keys) and self.keys[g] == key[0] else -1
+
+class SkipgramIndex(object):
+	"""
+	Skipgram trees for every mask of one window width, from a single count of the
+	windows, keyed by token ids. Switching masks is a dictionary lookup.
+	"""
+
+	def __init__(self, store, vocab, masks=None):
+		self.store = store
+		self.vocab = vocab
+		self.width = store.n
+		self.rows = store.rows.astype(np.uint32)
+		self.groups = {}
+		for mask in all_masks(self.width) if masks is None else masks:
+			self.mask_groups(mask)
+
+	@classmethod
+	def from_model(cls, ng_model, width, masks=None):
+		"""reuses the model's store for the width if it has one, else counts the windows of its stream"""
+		if width <= ng_model.max_ng_size:
+			return cls(ng_model.ng_stores[width-1], ng_model.vocab, masks)
+		starts = window_starts(ng_model.line_bounds, width)
+		return cls(NgramStore.from_rows(ngram_id_rows(ng_model.stream, starts, width), width), ng_model.vocab, masks)
+
+	@classmethod
+	def from_lines(cls, lines, width, masks=None):
+		vocab = Vocabulary()
+		stream, line_bounds = encode_lines(lines, vocab)
+		starts = window_starts(line_bounds, width)
+		return cls(NgramStore.from_rows(ngram_id_rows(stream, starts, width), width), vocab, masks)
+
+	def mask_groups(self, mask):
+		"""the MaskGroups of a mask, built on first use if it was not indexed up front"""
+		mask = normalize_mask(mask)
+		if len(mask) != self.width or not any(mask):
+			raise ValueError('mask needs {} positions, at least one visible'.format(self.width))
+		if mask not in self.groups:
+			self.groups[mask] = MaskGroups(self.rows, mask)
+		return self.groups[mask]
+
+	def fillers(self, mask, visible_ids):
+		"""(store indices, counts) of the ngrams matching a skipgram given by the ids of its visible tokens"""
+		groups = self.mask_groups(mask)
+		g = groups.group(visible_ids)
+		indices = groups.order[groups.bounds[g]:groups.bounds[g+1]] if g >= 0 else groups.order[:0]
+		return indices, self.store.counts[indices]
+
+	def tree(self, mask):
+		return SkipgramTree(self, normalize_mask(mask))
+
+	def skipgram_counts(self, mask):
+		"""{skipgram: total count of its ngrams}"""
+		groups = self.mask_groups(mask)
+		totals = np.add.reduceat(self.store.counts[groups.order], groups.bounds[:-1]) if len(groups.keys) else []
+		return dict(zip(self.tree(mask), np.asarray(totals).tolist()))
+
+	def most_uncertain(self, mask, k=20):
+		"""the k skipgrams with the most distinct fillers, as [(skipgram, {ngram: count})]"""
+		groups = self.mask_groups(mask)
+		tree = self.tree(mask)
+		widest = np.argsort(-np.diff(groups.bounds), kind='stable')[:k]
+		return [(tree.skipgram(g), tree.entries(g)) for g in widest.tolist()]
+
+class SkipgramTree(Mapping):
+	"""Read-only {skipgram: {ngram: count}} view of one mask of a SkipgramIndex"""
+
+	def __init__(self, index, mask):
+		self.index = index
+		self.mask = mask
+		self.groups = index.mask_groups(mask)
+
+	def skipgram(self, g):
+		row = self.index.store.rows[self.groups.order[self.groups.bounds[g]]].tolist()
+		return apply_mask_to_ngram(self.mask, ' '.join(self.index.vocab.decode(row)))
+
+	def entries(self, g):
+		indices = self.groups.order[self.groups.bounds[g]:self.groups.bounds[g+1]]
+		rows = self.index.store.rows[indices].tolist()
+		return dict(zip([' '.join(self.index.vocab.decode(row)) for row in rows], self.index.store.counts[indices].tolist()))
+
+	def __getitem__(self, skipgram):
+		tokens = skipgram.split()
+		if len(tokens) != len(self.mask) or any((token == MASK_TOKEN) == visible for token, visible in zip(tokens, self.mask)):
+			raise KeyError(skipgram)
+		ids = self.index.vocab.lookup([tokens[i] for i in self.groups.visible])
+		g = self.groups.group(ids) if ids is not None else -1
+		if g < 0:
+			raise KeyError(skipgram)
+		return self.entries(g)
+
+	def __iter__(self):
+		return (self.skipgram(g) for g in range(len(self)))
+
+	def __len__(self):
+		return len(self.groups.keys)
 
 def skipgram_counts_for_lines(lines, mask):
 	return sum_counters([skipgram_counts_for_line(line, mask) for line in lines])
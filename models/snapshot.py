@@ -0,0 +1,66 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+import numpy as np
+
+"""
+On-disk snapshots of built models: one directory per snapshot holding each array
+as a .npy file, opened with memory mapping so startup reads only the pages a
+query touches and concurrent processes share them through the page cache.
+Anything that is not an array (vocabulary, urls, tags) goes in JSON. The same
+layout, under its own version, holds the columnar corpus (utilities/corpus_store.py).
+"""
+
+SNAPSHOT_VERSION = 4	# bump whenever the layout or the meaning of a stored array changes
+
+def snapshot_key(*parts):
+	"""directory name for a snapshot of the given version, corpus and parameters"""
+	key = '|'.join(str(part) for part in (SNAPSHOT_VERSION,) + parts)
+	return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def write_snapshot(path, arrays, objects, version=SNAPSHOT_VERSION):
+	"""
+	arrays: {name: numpy array}
+	objects: {name: JSON-serializable value}
+	The snapshot is written to a temporary directory and renamed into place,
+	so readers never see a partial snapshot.
+	"""
+	parent = os.path.dirname(os.path.abspath(path))
+	os.makedirs(parent, exist_ok=True)
+	tmp = tempfile.mkdtemp(dir=parent)
+	for name, array in arrays.items():
+		np.save(os.path.join(tmp, name + '.npy'), np.ascontiguousarray(array))
+	for name, value in objects.items():
+		with open(os.path.join(tmp, name + '.json'), 'w') as f:
+			json.dump(value, f)
+	with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+		json.dump({'version': version, 'arrays': list(arrays), 'objects': list(objects)}, f)
+	try:
+		os.rename(tmp, path)
+	except OSError:		# another process finished the same snapshot first
+		shutil.rmtree(tmp)
+
+def read_snapshot(path, version=SNAPSHOT_VERSION, names=None):
+	"""
+	(arrays, objects) of a snapshot, with arrays memory-mapped read-only; None if
+	missing or stale. names: open only these arrays and objects (default: all)
+	"""
+	meta_path = os.path.join(path, 'meta.json')
+	if not os.path.exists(meta_path):
+		return None
+	with open(meta_path) as f:
+		meta = json.load(f)
+	if meta['version'] != version:
+		return None
+	arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r') for name in meta['arrays']
+				if names is None or name in names}
+	objects = {}
+	for name in meta['objects']:
+		if names is not None and name not in names:
+			continue
+		with open(os.path.join(path, name + '.json')) as f:
+			objects[name] = json.load(f)
+	return arrays, objects
@@ -0,0 +1,66 @@
+import numpy as np
+
+from utilities.ngram_utils import OrderCounts
+
+"""
+Tag -> document index for a corpus. Each tag's documents are kept both as a
+sorted id list and as a packed bitmap, so whether a document has a tag is a
+single bit test. Aggregating documents by tag is one sparse pass over every
+(tag, document) pair, with the tags becoming the documents of a new OrderCounts.
+"""
+
+class TagIndex(object):
+
+	def __init__(self, tags_by_doc):
+		"""tags_by_doc: the set of tags of each document, e.g. df['tags']"""
+		tags_by_doc = list(tags_by_doc)
+		self.num_docs = len(tags_by_doc)
+		self.tags = sorted(set().union(*tags_by_doc))
+		self.tag_ids = {tag: i for i, tag in enumerate(self.tags)}
+		pair_tags = np.array([self.tag_ids[tag] for tags in tags_by_doc for tag in tags], dtype=np.int64)
+		pair_docs = np.repeat(np.arange(self.num_docs), [len(tags) for tags in tags_by_doc])
+		order = np.lexsort((pair_docs, pair_tags))
+		self.doc_ids = pair_docs[order]		# documents of tag t: doc_ids[indptr[t]:indptr[t+1]]
+		self.indptr = np.searchsorted(pair_tags[order], np.arange(len(self.tags) + 1))
+		members = np.zeros((len(self.tags), self.num_docs), dtype=bool)
+		members[pair_tags, pair_docs] = True
+		self.bitmaps = np.packbits(members, axis=1)
+
+	def docs(self, tag):
+		"""sorted ids of the documents with the tag"""
+		t = self.tag_ids.get(tag)
+		return self.doc_ids[self.indptr[t]:self.indptr[t+1]] if t is not None else self.doc_ids[:0]
+
+	def has_tag(self, doc, tag):
+		t = self.tag_ids.get(tag)
+		return t is not None and bool(self.bitmaps[t, doc >> 3] >> (7 - (doc & 7)) & 1)
+
+	def mask(self, tag):
+		"""boolean array over documents, True where the document has the tag"""
+		t = self.tag_ids.get(tag)
+		if t is None:
+			return np.zeros(self.num_docs, dtype=bool)
+		return np.unpackbits(self.bitmaps[t], count=self.num_docs).astype(bool)
+
+	def aggregate(self, order, tags=None):
+		"""
+		OrderCounts with one document per tag (default: every tag, in self.tags order)
+		holding the summed term frequencies of the tag's documents
+		"""
+		tags = self.tags if tags is None else list(tags)
+		tag_docs = [self.docs(tag) for tag in tags]
+		pair_tags = np.repeat(np.arange(len(tags)), [len(docs) for docs in tag_docs])
+		pair_docs = np.concatenate(tag_docs) if tag_docs else self.doc_ids[:0]
+		lengths = np.diff(order.tf_indptr)[pair_docs]
+		first_entry = np.cumsum(lengths) - lengths
+		entries = np.repeat(order.tf_indptr[pair_docs] - first_entry, lengths) + np.arange(lengths.sum())
+		num_ngrams = len(order.rows)
+		keys, inverse = np.unique(np.repeat(pair_tags, lengths) * num_ngrams + order.tf_indices[entries], return_inverse=True)
+		tf_values = np.bincount(inverse.ravel(), weights=order.tf_values[entries], minlength=len(keys)).astype(np.int64)
+		present, columns = np.unique(keys % num_ngrams, return_inverse=True)
+		columns = columns.ravel()
+		return OrderCounts(order.rows[present],
+							np.bincount(columns, weights=tf_values, minlength=len(present)).astype(np.int64),
+							np.bincount(columns, minlength=len(present)).astype(np.int64),
+							np.searchsorted(keys // num_ngrams, np.arange(len(tags) + 1)),
+							columns, tf_values)
@@ -1,8 +1,8 @@
 import sys
 sys.path.append('.')
 
-import spacy
 from utilities import librarian
+from utilities.annotation import annotate
 from utilities.dictionary import (
 	enter_nested_item,
 	sum_counters,
@@ -18,6 +18,8 @@ has a DOBJ dependency relationship to its left child. Idea is to
 make better-educated guesses about what terms are interchangeable.
 """
 
+UNUSED_COMPONENTS = ['tagger', 'attribute_ruler', 'lemmatizer', 'ner']	# only the dependency parse is read
+
 def syntactic_subtree(token, doc):
 	return doc[token.left_edge.i:token.right_edge.i+1]
 
@@ -84,8 +86,6 @@ def print_prepositional_phrases_in_doc(doc):
 
 if __name__ == '__main__':
 	import random
-	nlp = spacy.load("en_core_web_sm")
-	print('loaded')
 	df = librarian.load_dataframe(truncate=25)
 	df['transcript'] = df['transcript'].apply(lambda x: librarian.clean_transcript(x))
 	texts = list(df['transcript'])
@@ -94,7 +94,7 @@ if __name__ == '__main__':
 
 	n = 200
 	print('about to compute')
-	first_n_docs = [nlp(d) for d in texts[:n]]
+	first_n_docs = annotate(texts[:n], disable=UNUSED_COMPONENTS, n_process=2)
 
 	#tokens_by_key = [tokens_by_dep_ancestors(doc) for doc in first_n_docs]
 	tokens_by_key = [tokens_by_dep_context(doc) for doc in first_n_docs]
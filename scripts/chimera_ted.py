@@ -4,15 +4,16 @@ sys.path.append('.')
 import random
 import itertools
 
-import spacy
-
 from utilities import librarian
+from utilities.annotation import annotate
 
 """
 Generalization of the "chimera" method described here:
 https://www.foundpoetryreview.com/blog/oulipost-16-chimera/
 """
 
+UNUSED_COMPONENTS = ['lemmatizer', 'ner']	# pos_ and dep_ are read
+
 def replace_mask_token_in_order(doc, mask_token, source_tokens):
 	"""Replace all occurrences of the given masked token with 
 	tokens from the iterable source_tokens"""
@@ -87,16 +88,13 @@ def randomly_replace_all_deps(doc):
 	return replace_deps_in_doc(doc, set(deps_for_doc(doc)))
 
 if __name__ == '__main__':
-	nlp = spacy.load("en_core_web_sm")	# or en_core_web_md or en_core_web_lg
-	print('loaded')
 	df = librarian.load_dataframe(truncate=250)
 	df['transcript'] = df['transcript'].apply(lambda x: librarian.clean_transcript(x))
 	texts = list(df['transcript'])
 	#random.shuffle(texts)
 
 	text1, text2 = texts[:2]
-	doc1 = nlp(text1)
-	doc2 = nlp(text2)
+	doc1, doc2 = annotate([text1, text2], model='en_core_web_sm', disable=UNUSED_COMPONENTS)	# or en_core_web_md or en_core_web_lg
 
 	nouns_replaced = replace_by_pos(doc1, doc2, "NOUN")
 	adjectives_replaced = replace_by_pos(doc1, doc2, "ADJ")
@@ -0,0 +1,26 @@
+import sys
+sys.path.append('.')
+import os
+import time
+import argparse
+
+from utilities import librarian
+
+"""
+One-time conversion of the CSVs into the columnar corpus that load_dataframe
+reads from then on (see utilities/corpus_store.py). Rerun it after changing
+the CSVs or the cleaning code; until then load_dataframe falls back to the CSVs.
+
+	python scripts/convert_corpus.py
+"""
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convert the TED CSVs into a columnar, pre-tokenized corpus.')
+	parser.add_argument('--output', default=librarian.CORPUS_PATH)
+	parser.add_argument('--workers', type=int, default=1, help='processes cleaning the transcripts')
+	args = parser.parse_args()
+
+	start = time.perf_counter()
+	num_talks = librarian.convert_corpus(args.output, args.workers)
+	size = sum(entry.stat().st_size for entry in os.scandir(args.output))
+	print('wrote {} talks to {} ({:.1f} MB) in {:.1f} s'.format(num_talks, args.output, size / 1e6, time.perf_counter() - start))
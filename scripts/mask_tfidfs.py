@@ -1,16 +1,12 @@
 import sys
-import math
 sys.path.append('.')
 
-from models.ngrams import (
-	ngram_counts_for_lines,
-	flatten_list,
-)
-
-from utilities.dictionary import (
-	top_n,
-	sum_counters
+from utilities.ngram_utils import (
+	ngrams_for_line,
+	top_tfidf_ngrams
 )
+from utilities.librarian import flatten_list
+from utilities.dictionary import top_n
 from resources.stopwords import stopwords
 
 """
@@ -61,27 +57,15 @@ def stopword_analysis(df):
 def top_n_keys(d, n):
 	return [k for k, v in top_n(d, n)]
 
-def tf_idf(lines, ngram_size, min_doc_freq_threshold=1):
-	total_docs = len(lines)
-	term_frequencies = list(map(lambda x: ngram_counts_for_lines(x, ngram_size), lines))
-	doc_frequencies = sum_counters([{k: 1 for k in counter} for counter in term_frequencies])
-	tfidfs = list(map(lambda x:
-		{k: tf * -math.log(doc_frequencies[k]/total_docs)
-		for k, tf in x.items()
-		if doc_frequencies[k] >= min_doc_freq_threshold}, term_frequencies)
-		)
-	return term_frequencies, doc_frequencies, tfidfs
-
 def mask_tfidfs(df):
 	lines_by_title = dict(zip(df['title'], df['lines']))
-	term_frequencies, doc_frequencies, tfidfs = tf_idf(df['lines'], ngram_size=1, min_doc_freq_threshold=2)
-	tfidfs_by_title = dict(zip(df['title'], tfidfs))
-
 	n = 100
+	keywords = top_tfidf_ngrams(df['lines'], ngram_size=1, k=n, min_doc_freq_threshold=2)
+	keywords_by_title = dict(zip(df['title'], keywords))
+
 	import random
 	title = random.choice(df['title'])
-	tfidfs = tfidfs_by_title[title]
-	top_keywords = set(top_n_keys(tfidfs, 100)) - stopwords
+	top_keywords = set(keywords_by_title[title]) - stopwords
 	for line in lines_by_title[title]:
 		tfidf_masked_line = ' '.join(mask_tokens_if_in_set(line.lower().split(), top_keywords))
 		stopword_masked_line = ' '.join(mask_content_words(line.lower().split()))
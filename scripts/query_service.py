@@ -0,0 +1,244 @@
+import sys
+sys.path.append('.')
+import json
+import asyncio
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from models.ngram_model import NgramModel
+from models.shared_model import export_model, SharedNgramModel
+from models.event_rates import EventRates
+from models.skipgrams import SkipgramIndex, mask_for_skipgram
+from utilities.counters import top_k_quotients
+from utilities.command_line import parse_mask
+
+"""
+Local HTTP/JSON service over one preloaded NgramModel, for many concurrent
+clients instead of one blocking input() loop per session:
+
+	python scripts/query_service.py --truncate 2500 --workers 2
+	curl 'localhost:8350/surprise?n=4&k=10'
+	curl 'localhost:8350/collocates?mask=110x011&term=brain'
+	curl 'localhost:8350/event_rates?event=laughter&n=3&tag=science'
+	curl 'localhost:8350/skipgram_fillers?skipgram=one+____+the'
+	curl -d '{"lines": ["thank you so much"], "n": 3}' localhost:8350/score
+
+GET / lists the endpoints and their parameters. Parameters come from the query
+string or a JSON body. The event loop only parses requests and writes responses;
+queries run on a pool of worker processes, each opening the model's snapshot
+(memory-mapped, so the arrays are shared through the page cache) and keeping
+what it builds for later requests. With --shared-memory the workers attach to
+one export of the model in shared memory instead (models/shared_model.py), which
+also shares the TF-IDF matrices. --workers 0 runs queries on one thread of the
+server process instead.
+"""
+
+### QUERIES ###
+
+class Queries(object):
+	"""the endpoints' computations over one model; event rates and skipgram indexes are built on first use"""
+
+	def __init__(self, model):
+		self.model = model
+		self._rates = None
+		self.skipgram_indexes = {}		# by width
+
+	@property
+	def rates(self):
+		if self._rates is None:
+			self._rates = EventRates(self.model)
+		return self._rates
+
+	def check_order(self, n):
+		if not 1 <= n <= self.model.max_ng_size:
+			raise ValueError('n must be between 1 and {}'.format(self.model.max_ng_size))
+
+	def surprise(self, n=3, min_count=3, min_doc_freq=5, k=20):
+		self.check_order(n)
+		by_unigram_surprise, by_bigram_surprise = self.model.top_ngrams_by_surprise(n, min_count, min_doc_freq, k)
+		return {'unigram': by_unigram_surprise, 'bigram': by_bigram_surprise}
+
+	def collocates(self, mask='110x011', term='', min_doc_freq=5, k=25):
+		"""the term's collocates relative to their overall rates, as in ted.collocates_analysis"""
+		if set(mask.lower()) - set('01x') or 'x' not in mask.lower():
+			raise ValueError('mask holds 0s, 1s and the xs where the term goes, e.g. 110x011')
+		mask = parse_mask(mask)
+		collocates = self.model.collocates_for_term(mask, term, min_doc_freq)
+		return top_k_quotients(collocates, self.model.get_ngram_rates(1), k) if collocates else []
+
+	def event_rates(self, event='laughter', n=3, count_threshold=20, k=20, tag=''):
+		self.check_order(n)
+		event = '<{}>'.format(event.strip('<>').lower())
+		if event not in self.rates.events:
+			raise ValueError('unknown event; one of {}'.format(', '.join(self.rates.events)))
+		return self.rates.top_rates(event, n, count_threshold, k, tag or None)
+
+	def skipgram_fillers(self, skipgram='', k=20):
+		"""the k most frequent ngrams matching a skipgram such as 'one ____ the'"""
+		mask = mask_for_skipgram(skipgram)
+		if not any(mask) or all(mask):
+			raise ValueError('skipgram needs visible tokens and at least one ____')
+		if len(mask) not in self.skipgram_indexes:
+			self.skipgram_indexes[len(mask)] = SkipgramIndex.from_model(self.model, len(mask), masks=[])
+		fillers = self.skipgram_indexes[len(mask)].tree(mask).get(skipgram.lower(), {})
+		return sorted(fillers.items(), key=lambda pair: -pair[1])[:k]
+
+	def score(self, lines=(), n=0):
+		"""log probability and perplexity of each line under the Kneser-Ney model of order n (0: the largest)"""
+		if n:
+			self.check_order(n)
+		lines = [line.lower() for line in lines]
+		log_probs, perplexities = self.model.score_lines(lines, n or None)
+		return [{'line': line, 'log_prob': log_prob, 'perplexity': perplexity}
+				for line, log_prob, perplexity in zip(lines, log_probs.tolist(), perplexities.tolist())]
+
+# endpoint -> parameters and their defaults, which also give their types
+ENDPOINTS = {
+	'surprise': {'n': 3, 'min_count': 3, 'min_doc_freq': 5, 'k': 20},
+	'collocates': {'mask': '110x011', 'term': '', 'min_doc_freq': 5, 'k': 25},
+	'event_rates': {'event': 'laughter', 'n': 3, 'count_threshold': 20, 'k': 20, 'tag': ''},
+	'skipgram_fillers': {'skipgram': '', 'k': 20},
+	'score': {'lines': [], 'n': 0},
+}
+
+### WORKERS ###
+
+queries = None		# this process's Queries
+
+def init_worker(snapshot_path):
+	global queries
+	queries = Queries(NgramModel.load(snapshot_path))
+
+def init_shared_worker(handle):
+	global queries
+	queries = Queries(SharedNgramModel.attach(handle))
+
+def run_query(endpoint, params):
+	return getattr(queries, endpoint)(**params)
+
+def parse_params(endpoint, query_string, body):
+	"""the endpoint's parameters from a query string and a JSON body, converted to the types of their defaults"""
+	defaults = ENDPOINTS[endpoint]
+	given = {name: values if isinstance(defaults.get(name), list) else values[-1]
+				for name, values in parse_qs(query_string).items()}
+	if body:
+		given.update(json.loads(body))
+	params = {}
+	for name, value in given.items():
+		if name not in defaults:
+			raise ValueError('unknown parameter ' + name)
+		default = defaults[name]
+		if isinstance(default, list):
+			if not isinstance(value, list):
+				raise ValueError('{} must be a list, e.g. {{"{}": ["..."]}}'.format(name, name))
+			params[name] = [str(item) for item in value]
+		else:
+			params[name] = type(default)(value)
+	return params
+
+### HTTP ###
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+class QueryService(object):
+
+	def __init__(self, model, executor):
+		self.model = model
+		self.executor = executor
+
+	async def respond(self, method, target, body):
+		"""(status, payload) for one request"""
+		url = urlsplit(target)
+		endpoint = url.path.strip('/')
+		if endpoint == '':
+			return 200, ENDPOINTS
+		if endpoint == 'health':
+			return 200, {'documents': len(self.model.doc_bounds) - 1, 'vocabulary': len(self.model.vocab),
+							'max_ng_size': self.model.max_ng_size}
+		if endpoint not in ENDPOINTS:
+			return 404, {'error': 'no endpoint ' + endpoint}
+		try:
+			params = parse_params(endpoint, url.query, body)
+			result = await asyncio.get_running_loop().run_in_executor(self.executor, run_query, endpoint, params)
+		except (ValueError, TypeError, KeyError) as e:
+			return 400, {'error': '{}: {}'.format(type(e).__name__, e)}
+		except Exception as e:
+			return 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+		return 200, result
+
+	async def handle(self, reader, writer):
+		"""serves the requests of one keep-alive connection in turn"""
+		try:
+			while True:
+				request_line = await reader.readline()
+				if not request_line.strip():
+					break
+				method, target, version = request_line.decode('latin-1').split()
+				headers = {}
+				while True:
+					line = await reader.readline()
+					if not line.strip():
+						break
+					name, value = line.decode('latin-1').split(':', 1)
+					headers[name.strip().lower()] = value.strip()
+				body = await reader.readexactly(int(headers.get('content-length', 0)))
+				status, payload = await self.respond(method, target, body)
+				keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+				writer.write(http_response(status, payload, keep_alive))
+				await writer.drain()
+				if not keep_alive:
+					break
+		except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+def http_response(status, payload, keep_alive):
+	body = json.dumps(payload, default=json_default).encode()
+	head = 'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n'.format(
+			status, REASONS[status], len(body), 'keep-alive' if keep_alive else 'close')
+	return head.encode('latin-1') + body
+
+def json_default(value):
+	if isinstance(value, np.generic):
+		return value.item()
+	raise TypeError('not JSON serializable: {}'.format(type(value).__name__))
+
+async def serve(args):
+	model = NgramModel.cached(truncate=args.truncate, max_ng_size=args.max_ng_size, cache_dir=args.cache_dir)
+	export = export_model(model) if args.workers > 0 and args.shared_memory else None
+	if export is not None:
+		executor = ProcessPoolExecutor(args.workers, initializer=init_shared_worker, initargs=(export.handle,))
+	elif args.workers > 0:
+		executor = ProcessPoolExecutor(args.workers, initializer=init_worker, initargs=(model.snapshot_path,))
+	else:
+		global queries
+		queries = Queries(model)
+		executor = ThreadPoolExecutor(1)
+	try:
+		server = await asyncio.start_server(QueryService(model, executor).handle, args.host, args.port)
+		print('serving {} talks on http://{}:{}/ with {} workers'.format(len(model.doc_bounds) - 1, args.host, args.port, args.workers))
+		async with server:
+			await server.serve_forever()
+	finally:
+		executor.shutdown(cancel_futures=True)
+		if export is not None:
+			export.close()
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve queries over a preloaded NgramModel as HTTP/JSON.')
+	parser.add_argument('--truncate', type=int, default=2500)
+	parser.add_argument('--max-ng-size', type=int, default=4)
+	parser.add_argument('--cache-dir', default='cache')
+	parser.add_argument('--host', default='127.0.0.1')
+	parser.add_argument('--port', type=int, default=8350)
+	parser.add_argument('--workers', type=int, default=2, help='query processes; 0 runs queries on a thread of the server')
+	parser.add_argument('--shared-memory', action='store_true', help='workers attach to one shared memory export of the model')
+	args = parser.parse_args()
+	try:
+		asyncio.run(serve(args))
+	except KeyboardInterrupt:
+		pass
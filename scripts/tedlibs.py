@@ -3,7 +3,7 @@ sys.path.append('.')
 import random
 
 from models.skipgrams import (
-	build_skipgram_tree,
+	SkipgramIndex,
 	show_slot_entropies
 )
 
@@ -13,10 +13,9 @@ from utilities.dictionary import (
 	bottom_n,
 	above_threshold
 )
-from models.ngrams import (
-	flatten_list
-)
+from models.tag_index import TagIndex
 from utilities import librarian
+from utilities.librarian import flatten_list
 from utilities import command_line
 from resources.tag_counts import tag_counts
 
@@ -26,8 +25,9 @@ if __name__ == "__main__":
 
 	mask = [True, False, True]
 	all_lines = flatten_list(df['lines'])
-	skipgram_tree = build_skipgram_tree(mask, all_lines)
-	skipgram_counts = {k: sum(list(v.values())) for k, v in skipgram_tree.items()}
+	skipgram_index = SkipgramIndex.from_lines(all_lines, len(mask))	# every mask of the width; switch with skipgram_index.tree(other_mask)
+	skipgram_tree = skipgram_index.tree(mask)
+	skipgram_counts = skipgram_index.skipgram_counts(mask)
 	common_skipgrams = above_threshold(skipgram_counts, 1)
 
 	# measure entropy among the n most likely options
@@ -35,11 +35,12 @@ if __name__ == "__main__":
 							for k in skipgram_tree if k in common_skipgrams}
 
 	tags = [tag for tag, count in top_n(tag_counts, 50)[10:]]	# ranks 11 to 50
+	tag_index = TagIndex(df['tags'])
 
 	# User chooses tag, computer chooses random line from talk with that tag
 	while True:
 		chosen_tag = command_line.user_choose_from_list(tags[:20])
-		line_lists = [lines for i, lines in enumerate(df['lines']) if chosen_tag in df['tags'][i]]
+		line_lists = [df['lines'].iloc[i] for i in tag_index.docs(chosen_tag)]
 		lines = flatten_list(line_lists)
 		line = random.choice(lines)
 		show_slot_entropies(line, skipgram_entropies, skipgram_tree)
\ No newline at end of file
@@ -3,24 +3,14 @@ import math
 import pandas as pd
 from collections import Counter
 
-from models.ngram_model import (
-	NgramModel,
-	ngram_counts_for_lines,
-)
+from models.ngram_model import NgramModel
+from models.event_rates import EventRates
 
-from utilities.dictionary import (
-	sum_counters,
-	keywise_quotients,
-	normalize,
-	keywise_rates_of_condition,
-	top_n,
-	bottom_n
-)
+from utilities.counters import top_k_quotients
 from utilities.command_line import (
 	user_create_mask,
-	explore_nested_dict,
-	print_top_n,
-	print_bottom_n
+	explore_queries,
+	print_pairs
 )
 
 ##############################################
@@ -35,11 +25,11 @@ def surprise_analysis(ng_model, n, min_count_threshold, min_doc_freq_threshold,
 	Similarly, the "bigram surprise" is the ratio of its observed rate to its
 	expected rate under a bigram model.
 	"""
-	by_unigram_surprise, by_bigram_surprise = ng_model.ngrams_by_unigram_and_bigram_surprise(n, min_count_threshold, min_doc_freq_threshold)
+	by_unigram_surprise, by_bigram_surprise = ng_model.top_ngrams_by_surprise(n, min_count_threshold, min_doc_freq_threshold, num_to_print)
 	print("\nTOP {}-GRAMS BY UNIGRAM SURPRISE".format(n))
-	print_top_n(by_unigram_surprise, num_to_print)
+	print_pairs(by_unigram_surprise)
 	print("\nTOP {}-GRAMS BY BIGRAM SURPRISE".format(n))
-	print_top_n(by_bigram_surprise, num_to_print)
+	print_pairs(by_bigram_surprise)
 
 def collocates_analysis(ng_model):
 	"""
@@ -56,56 +46,54 @@ def collocates_analysis(ng_model):
 	immediately after a given 2-gram, equivalent to a trigram model.
 	"""
 	mask = user_create_mask()
-	collocates = ng_model.build_collocates_from_mask(mask=mask, min_doc_freq_threshold=5)
-	print('normalizing...')
-	normalized_collocates = {k: normalize(v) for k, v in collocates.items()}
-	print('comparing to baseline...')
-	relative_collocates = {k: keywise_quotients(v, ng_model.unigram_model) for k, v in normalized_collocates.items()}
-	explore_nested_dict(relative_collocates, 25)
-
-def laugh_rate_analysis(df, n, count_threshold, num_to_print):
-	"""
-	For a given ngram size, find which ngrams were followed by <Laughter>
-	at the highest rates.
-	"""
+	baseline = ng_model.get_ngram_rates(1)
 
-	laugh_ngram_counts = sum_counters(df['laugh_lines'].apply(lambda x: ngram_counts_for_lines(x, n)))
-	overall_ngram_counts = sum_counters(df['lines'].apply(lambda x: ngram_counts_for_lines(x, n)))
-	laugh_rates = keywise_rates_of_condition( condition_counts=laugh_ngram_counts,
-												overall_counts=overall_ngram_counts,
-												count_threshold=count_threshold
-											)
+	def top_relative_collocates(term):
+		collocates = ng_model.collocates_for_term(mask, term, min_doc_freq_threshold=5)
+		return top_k_quotients(collocates, baseline, 25) if collocates else []
 
-	print('\nTOP LAUGH RATES (min {} occurrences):'.format(count_threshold))
-	for word, quotient in top_n(laugh_rates, num_to_print):
-		print(word + '\t' + str(quotient))
+	explore_queries(top_relative_collocates)
 
-	# print('\nLOWEST NONZERO LAUGH RATES (min {} occurrences):'.format(count_threshold))
-	# for word, quotient in bottom_n(laugh_rates, num_to_print):
-	# 	print(word + '\t' + str(quotient))
+def event_rate_analysis(ng_model, n, count_threshold, num_to_print, tags_by_doc=None, tag=None):
+	"""
+	For a given ngram size, find which ngrams were followed by each audience event
+	(<Laughter>, <Applause>, ...) at the highest rates, optionally within the talks
+	with a given tag.
+	"""
+	event_rates = EventRates(ng_model, tags_by_doc)
+	for event in event_rates.events:
+		print('\nTOP {} RATES (min {} occurrences{}):'.format(event.upper(), count_threshold, '' if tag is None else ', tag ' + tag))
+		for word, quotient in event_rates.top_rates(event, n, count_threshold, num_to_print, tag):
+			print(word + '\t' + str(quotient))
 
-def masked_ngrams_analysis(ng_model):
-	from models import skipgrams
+def masked_ngrams_analysis(ng_model, skipgram_indexes=None):
+	"""
+	For a mask the user builds, show the skipgrams with the most distinct fillers.
+	skipgram_indexes: a {width: SkipgramIndex} dict to keep between calls, so a
+	width asked for again is not indexed again
+	"""
+	from models.skipgrams import SkipgramIndex
+	skipgram_indexes = {} if skipgram_indexes is None else skipgram_indexes
 	mask = user_create_mask()
-	skipgram_tree = skipgrams.build_skipgram_tree(mask, ng_model.lines)
-	most_uncertain_skipgrams = sorted(skipgram_tree.items(), key=lambda x: len(x[1]), reverse=True)
-	for x in most_uncertain_skipgrams[:20]:
+	if len(mask) not in skipgram_indexes:
+		skipgram_indexes[len(mask)] = SkipgramIndex.from_model(ng_model, len(mask), masks=[])
+	for x in skipgram_indexes[len(mask)].most_uncertain(mask, 20):
 		print(x)
-		print()		
+		print()
 
 
 
 if __name__ == '__main__':
-	from pprint import pprint
-	from utilities import librarian
-	df = librarian.load_dataframe(truncate=250)		# Optional: clip dataframe for testing
-	ng_model = NgramModel(df, max_ng_size=4)
+	from utilities import instrumentation
+	instrumentation.enable(verbose=True)		# a timing line per finished stage; trace_memory=True adds peaks
+	ng_model = NgramModel.cached(truncate=250, max_ng_size=4)		# rebuilt only when the corpus or cleaning code changes
 
 	### PROCEDURES (uncomment to run)
 	
 	surprise_analysis(ng_model, n=4, min_count_threshold=3, min_doc_freq_threshold=5)
 	#collocates_analysis(ng_model)
-	#laugh_rate_analysis(df, n=3, count_threshold=20, num_to_print=20)
+	#event_rate_analysis(ng_model, n=3, count_threshold=20, num_to_print=20)
+	#event_rate_analysis(ng_model, n=2, count_threshold=5, num_to_print=20, tag='science')
 	#masked_ngrams_analysis(ng_model)
 
 
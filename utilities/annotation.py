@@ -0,0 +1,44 @@
+import hashlib
+import os
+
+import spacy
+from spacy.tokens import DocBin
+
+"""
+Shared spaCy annotation layer. Texts are parsed in batches with nlp.pipe, with
+the pipeline components a script does not use disabled, and every parsed Doc is
+cached on disk as a DocBin keyed by the hash of its text. The cache directory is
+keyed by model name, model version and enabled components, so a cached Doc is
+only reused when the same pipeline would have produced it.
+"""
+
+CACHE_DIR = 'cache/docs'
+
+def annotate(texts, model='en_core_web_sm', disable=(), batch_size=32, n_process=1, cache_dir=CACHE_DIR):
+	"""parsed Docs for texts, in order; only texts missing from the cache are parsed"""
+	nlp = spacy.load(model, disable=list(disable))
+	model_dir = os.path.join(cache_dir, pipeline_key(nlp))
+	os.makedirs(model_dir, exist_ok=True)
+	paths = [os.path.join(model_dir, text_hash(text) + '.spacy') for text in texts]
+	docs = [read_doc(path, nlp) if os.path.exists(path) else None for path in paths]
+	missing = [i for i, doc in enumerate(docs) if doc is None]
+	parsed = nlp.pipe((texts[i] for i in missing), batch_size=batch_size, n_process=n_process)
+	for i, doc in zip(missing, parsed):
+		write_doc(paths[i], doc)
+		docs[i] = doc
+	return docs
+
+def pipeline_key(nlp):
+	"""model name and version plus the enabled components, e.g. en_core_web_sm-3.7.1-tok2vec.parser"""
+	return '{}_{}-{}-{}'.format(nlp.meta['lang'], nlp.meta['name'], nlp.meta['version'], '.'.join(nlp.pipe_names))
+
+def text_hash(text):
+	return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def read_doc(path, nlp):
+	return next(DocBin().from_disk(path).get_docs(nlp.vocab))
+
+def write_doc(path, doc):
+	tmp_path = path + '.tmp'
+	DocBin(docs=[doc]).to_disk(tmp_path)
+	os.replace(tmp_path, path)
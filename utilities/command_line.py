@@ -16,7 +16,11 @@ def user_choose_from_list(options):
 
 def user_create_mask():
 	user_input = input('Enter mask as 0s, 1s and Xs, e.g. 110x011:\n')
-	return [translation_table[character] for character in user_input]
+	return parse_mask(user_input)
+
+def parse_mask(text):
+	"""'110x011' -> [True, True, False, 'X', False, True, True]"""
+	return [translation_table[character] for character in text]
 
 def print_top_n(d, n=20):
 	print('\n'.join([str(pair) for pair in top_n(d, n)]))
@@ -24,6 +28,9 @@ def print_top_n(d, n=20):
 def print_bottom_n(d, n=20):
 	print('\n'.join([str(pair) for pair in bottom_n(d, n)]))
 
+def print_pairs(pairs):
+	print('\n'.join([str(pair) for pair in pairs]))
+
 def explore_model(ngram_model):
 	while True:
 		key = input('Enter word:\n')
@@ -36,3 +43,10 @@ def explore_nested_dict(d, top_n=20):
 		if key in d:
 			print_top_n(d[key], top_n)
 
+def explore_queries(query):
+	"""like explore_nested_dict, but each entry is a ranked list of pairs computed on demand by query(key)"""
+	while True:
+		key = input('Enter word:\n')
+		result = query(key)
+		if result:
+			print_pairs(result)
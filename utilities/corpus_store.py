@@ -0,0 +1,182 @@
+import numpy as np
+import pandas as pd
+
+from utilities.vocabulary import Vocabulary
+from models.snapshot import write_snapshot, read_snapshot
+
+"""
+Columnar, pre-tokenized copy of the merged and cleaned corpus, written once by
+`python scripts/convert_corpus.py` and read by librarian.load_dataframe in
+place of the CSVs. It is a snapshot directory (models/snapshot.py) of .npy
+columns, memory-mapped, so reading some columns of the first talks touches
+only those bytes:
+
+- lines: the tokens of every line as ids into one stream (tokens keep their
+  case; whitespace within a line comes back as single spaces), line_bounds
+  into the stream and doc_bounds into the lines
+- laughter, applause: a packed bit per line, set on the <Laughter> and
+  <Applause> event lines; laugh_lines and applause_lines are read off them
+- tags: ids into one tag list, with tag_bounds per talk
+- other text columns (title, url, transcript, ...): UTF-8 bytes with offsets
+  per talk and a packed bit per talk for missing values
+- numeric columns: one array each
+"""
+
+CORPUS_VERSION = 1		# bump whenever the layout changes
+EVENT_COLUMNS = {'laughter': '<Laughter>', 'applause': '<Applause>'}
+LINE_COLUMNS = {'lines': None, 'laugh_lines': 'laughter', 'applause_lines': 'applause'}		# -> event bits they are read with
+
+def write_columnar_corpus(path, df, source=None):
+	"""
+	df: a cleaned dataframe, as librarian.read_csv_dataframe returns it
+	source: JSON-serializable description of what df was made from, checked on read
+	"""
+	arrays, columns = {}, []
+	for name in df.columns:
+		values = df[name]
+		if name in LINE_COLUMNS or name == 'tags':
+			columns.append({'name': name, 'kind': 'lines' if name in LINE_COLUMNS else 'tags'})
+		elif pd.api.types.is_numeric_dtype(values.dtype):
+			arrays[name] = values.to_numpy()
+			columns.append({'name': name, 'kind': 'numeric'})
+		else:
+			arrays[name + '.data'], arrays[name + '.offsets'], arrays[name + '.missing'] = encode_strings(values)
+			columns.append({'name': name, 'kind': 'string'})
+
+	vocab = Vocabulary()
+	stream, line_bounds, doc_bounds = [], [0], [0]
+	for lines in df['lines']:
+		for line in lines:
+			stream.extend(vocab.encode(line.split()))
+			line_bounds.append(len(stream))
+		doc_bounds.append(len(line_bounds) - 1)
+	arrays['stream'] = np.array(stream, dtype=np.int32)
+	arrays['line_bounds'] = np.array(line_bounds, dtype=np.int64)
+	arrays['doc_bounds'] = np.array(doc_bounds, dtype=np.int64)
+	single_tokens = np.full(len(line_bounds) - 1, -1)		# the token of each one-token line
+	is_single = np.diff(arrays['line_bounds']) == 1
+	single_tokens[is_single] = arrays['stream'][arrays['line_bounds'][:-1][is_single]]
+	for name, event in EVENT_COLUMNS.items():
+		arrays[name] = np.packbits(is_single & (single_tokens == vocab.token_ids.get(event, -1)))
+
+	tags = sorted(set().union(*df['tags'])) if len(df) else []
+	tag_ids = {tag: i for i, tag in enumerate(tags)}
+	arrays['tag_ids'] = np.array([tag_ids[tag] for doc_tags in df['tags'] for tag in sorted(doc_tags)], dtype=np.int32)
+	arrays['tag_bounds'] = np.concatenate([[0], np.cumsum([len(doc_tags) for doc_tags in df['tags']])]).astype(np.int64)
+
+	write_snapshot(path, arrays, {'columns': columns, 'vocab': vocab.tokens, 'tags': tags, 'source': source,
+									'num_docs': len(df)}, version=CORPUS_VERSION)
+
+def read_columnar_corpus(path, columns=None, truncate=None, source=None):
+	"""
+	The first `truncate` talks (default: all) as a dataframe of the given columns
+	(default: all), or None if there is no corpus at path, or it was written by
+	another layout version or from another source than `source`.
+	"""
+	info = read_snapshot(path, CORPUS_VERSION, names=['columns', 'source', 'num_docs'])
+	if info is None or (source is not None and not same_source(info[1]['source'], source)):
+		return None
+	stored = {column['name']: column['kind'] for column in info[1]['columns']}
+	columns = list(stored) if columns is None else list(columns)
+	missing = [name for name in columns if name not in stored]
+	if missing:
+		raise KeyError('no column {} in the corpus at {}'.format(', '.join(missing), path))
+	arrays, objects = read_snapshot(path, CORPUS_VERSION, names=column_files(columns, stored))
+	num_docs = info[1]['num_docs'] if truncate is None else min(truncate, info[1]['num_docs'])
+	lines_by_doc = None
+	data = {}
+	for name in columns:
+		if stored[name] == 'numeric':
+			data[name] = np.array(arrays[name][:num_docs])
+		elif stored[name] == 'string':
+			data[name] = decode_strings(arrays[name + '.data'], arrays[name + '.offsets'], arrays[name + '.missing'], num_docs)
+		elif stored[name] == 'tags':
+			tags = np.array(objects['tags'], dtype=object)
+			bounds = arrays['tag_bounds'][:num_docs+1].tolist()
+			doc_tags = tags[arrays['tag_ids'][:bounds[-1]]].tolist()
+			data[name] = [set(doc_tags[lo:hi]) for lo, hi in zip(bounds[:-1], bounds[1:])]
+		else:
+			if lines_by_doc is None:
+				lines_by_doc = decode_lines(arrays, objects['vocab'], num_docs)
+			if name == 'lines':
+				data[name] = lines_by_doc
+			else:
+				data[name] = lines_before_events(lines_by_doc, arrays[LINE_COLUMNS[name]], arrays['doc_bounds'][:num_docs+1])
+	df = pd.DataFrame(index=pd.RangeIndex(num_docs))
+	for name in columns:		# numbers and text get the dtypes read_csv would give them
+		df[name] = pd.Series(data[name], index=df.index, dtype=object if stored[name] in ('lines', 'tags') else None)
+	return df
+
+def read_corpus_source(path):
+	"""the source a corpus was written from, or None if there is no corpus at path"""
+	info = read_snapshot(path, CORPUS_VERSION, names=['source'])
+	return info[1]['source'] if info is not None else None
+
+def column_files(columns, stored):
+	"""the arrays and objects that the given columns are read from"""
+	names = []
+	for name in columns:
+		if stored[name] == 'numeric':
+			names.append(name)
+		elif stored[name] == 'string':
+			names += [name + '.data', name + '.offsets', name + '.missing']
+		elif stored[name] == 'tags':
+			names += ['tag_ids', 'tag_bounds', 'tags']
+		else:
+			names += ['stream', 'line_bounds', 'doc_bounds', 'vocab']
+			if LINE_COLUMNS[name] is not None:
+				names.append(LINE_COLUMNS[name])
+	return names
+
+def same_source(stored, current):
+	"""whether every part of the current source that can still be checked matches the stored one"""
+	if isinstance(stored, dict) and isinstance(current, dict):
+		return all(key in stored and same_source(stored[key], value) for key, value in current.items())
+	return current is None or stored == current
+
+### ENCODING ###
+
+def encode_strings(values):
+	"""(UTF-8 bytes, offsets, packed missing bits) of a column of strings; anything else counts as missing"""
+	encoded = [value.encode('utf-8') if isinstance(value, str) else b'' for value in values]
+	offsets = np.concatenate([[0], np.cumsum([len(value) for value in encoded])]).astype(np.int64)
+	missing = np.packbits([not isinstance(value, str) for value in values])
+	return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets, missing
+
+def decode_strings(data, offsets, missing, num_docs):
+	offsets = offsets[:num_docs+1].tolist()
+	blob = data[:offsets[-1]].tobytes()
+	is_missing = np.unpackbits(missing, count=num_docs).tolist() if num_docs else []
+	return [np.nan if absent else blob[lo:hi].decode('utf-8')
+			for lo, hi, absent in zip(offsets[:-1], offsets[1:], is_missing)]
+
+def decode_lines(arrays, vocab, num_docs):
+	"""
+	each of the first num_docs talks' lines, as text: every token is followed by a
+	space or, at the end of its line, a newline, so all lines come from one join
+	and one split (tokens hold no whitespace); an empty line stands in as one '' token
+	"""
+	doc_bounds = arrays['doc_bounds'][:num_docs+1]
+	line_bounds = np.asarray(arrays['line_bounds'][:doc_bounds[-1]+1])
+	lengths = np.diff(line_bounds)
+	slots = np.maximum(lengths, 1)
+	slot_starts = np.cumsum(slots) - slots
+	ids = np.full(slots.sum(), len(vocab))
+	ids[np.repeat(slot_starts, lengths) + np.arange(lengths.sum()) - np.repeat(line_bounds[:-1] - line_bounds[0], lengths)] = \
+		arrays['stream'][line_bounds[0]:line_bounds[-1]]
+	pieces = np.empty(2 * len(ids), dtype=object)
+	pieces[0::2] = np.array(vocab + [''], dtype=object)[ids]
+	pieces[1::2] = ' '
+	pieces[2 * (slot_starts + slots) - 1] = '\n'
+	lines = ''.join(pieces.tolist()).split('\n')[:-1]
+	doc_bounds = doc_bounds.tolist()
+	return [lines[lo:hi] for lo, hi in zip(doc_bounds[:-1], doc_bounds[1:])]
+
+def lines_before_events(lines_by_doc, event_bits, doc_bounds):
+	"""for each talk, its lines directly followed by an event line, as get_laugh_lines finds them"""
+	is_event = np.unpackbits(event_bits, count=int(doc_bounds[-1])).astype(bool)
+	result = []
+	for lines, lo in zip(lines_by_doc, doc_bounds[:-1].tolist()):
+		following = np.flatnonzero(is_event[lo+1:lo+len(lines)]).tolist()
+		result.append([lines[i] for i in following])
+	return result
@@ -0,0 +1,58 @@
+import heapq
+from operator import itemgetter
+
+"""
+One-pass algebra over {key: number} counters. Nothing here builds an
+intermediate dict: filters, normalizations and quotients are fused into a
+single generator that feeds a partial (heap) selection of the top or bottom k.
+"""
+
+value_of = itemgetter(1)
+
+### SELECTION ###
+
+def top_k(pairs, k=10):
+	"""the k (key, value) pairs with the largest values; same result as a full sort"""
+	return heapq.nlargest(k, pairs, key=value_of)
+
+def bottom_k(pairs, k=10):
+	return heapq.nsmallest(k, pairs, key=value_of)
+
+### MERGING ###
+
+def merge_counters(counters):
+	"""
+	sum any number of counters in one pass over their entries; keys keep the order
+	in which they first appear, as with entering them one by one
+	"""
+	counters = [counter for counter in counters if counter]
+	if not counters:
+		return {}
+	agg = dict(counters[0])
+	get = agg.get
+	for counter in counters[1:]:
+		for k, v in counter.items():
+			agg[k] = get(k, 0) + v
+	return agg
+
+### FUSED PIPELINES ###
+
+def normalized(d):
+	"""(key, value / total) pairs, without building the normalized dict"""
+	total = sum(d.values())
+	return ((k, v / total) for k, v in d.items())
+
+def quotients(pairs, baseline):
+	"""(key, value / baseline[key]) for the keys present in the baseline"""
+	return ((k, v / baseline[k]) for k, v in pairs if k in baseline)
+
+def rates_of_condition(condition_counts, overall_counts, count_threshold=1):
+	"""(key, condition count / overall count) for keys with overall count >= count_threshold"""
+	for k, v in condition_counts.items():
+		overall = overall_counts[k]
+		if overall >= count_threshold:
+			yield k, v / overall
+
+def top_k_quotients(d, baseline, k=10):
+	"""filter -> normalize -> divide by baseline -> top k, in one pass"""
+	return top_k(quotients(normalized(d), baseline), k)
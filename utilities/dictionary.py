@@ -1,5 +1,12 @@
 import math
 
+from utilities.counters import (
+	top_k,
+	bottom_k,
+	merge_counters,
+	rates_of_condition
+)
+
 ### DICTIONARY HELPERS ###
 
 def normalize(d):
@@ -7,10 +14,10 @@ def normalize(d):
 	return {k: v/total for k, v in d.items()}
 
 def top_n(d, n=10):
-	return sorted(d.items(), key=lambda x: x[1], reverse=True)[:n]
+	return top_k(d.items(), n)
 
 def bottom_n(d, n=10):
-	return sorted(d.items(), key=lambda x: x[1], reverse=False)[:n]
+	return bottom_k(d.items(), n)
 
 def above_threshold(d, threshold):
 	return {k: v for k, v in d.items() if v >= threshold}
@@ -20,16 +27,11 @@ def keywise_quotients(d, baseline):
 
 def keywise_rates_of_condition(condition_counts, overall_counts, count_threshold=1):
 	"""e.g. P(laugh|ngram)"""
-	common_condition_counts = {k: v for k, v in condition_counts.items() if overall_counts[k]>=count_threshold}
-	return {k: v/overall_counts[k] for k, v in common_condition_counts.items()}
+	return dict(rates_of_condition(condition_counts, overall_counts, count_threshold))
 
 def sum_counters(counters):
 	"""counters: a list of Counter objects"""
-	agg = {}
-	for counter in counters:
-		for k, v in counter.items():
-			enter_item(agg, k, v)
-	return agg
+	return merge_counters(counters)
 
 def sum_nested_counters(nested_counters):
 	"""nested counters: [ {string: {string: number}}, ... ]"""
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import cProfile
+import tracemalloc
+
+"""
+Nested timed spans around pipeline stages. Instrumentation is off by default
+and a span then costs one function call; once enabled, each span records wall
+time, CPU time, the cardinalities the stage reports (ngrams, documents, ...)
+and optionally the tracemalloc peak above the memory in use when it started,
+and a cProfile dump. Typical use:
+
+	from utilities import instrumentation
+	instrumentation.enable(trace_memory=True, profile_dir='cache/profiles')
+	model = NgramModel(df, 4)
+	print(instrumentation.format_report())
+	instrumentation.write_report('build_report.json')
+"""
+
+class Span(object):
+
+	def __init__(self, name):
+		self.name = name
+		self.children = []
+		self.counts = {}
+		self.wall = 0.
+		self.cpu = 0.
+		self.peak_mb = None
+		self.start_memory = 0
+		self.peak_memory = 0
+		self.profile_path = None
+		self.wall_start = 0.
+		self.cpu_start = 0.
+
+	def record(self, **counts):
+		"""attach output sizes to the span, e.g. span.record(ngrams=len(rows))"""
+		self.counts.update(counts)
+
+	def as_dict(self):
+		d = {'name': self.name, 'wall_s': round(self.wall, 6), 'cpu_s': round(self.cpu, 6)}
+		if self.peak_mb is not None:
+			d['peak_mb'] = round(self.peak_mb, 3)
+		if self.counts:
+			d['counts'] = self.counts
+		if self.profile_path:
+			d['profile'] = self.profile_path
+		if self.children:
+			d['children'] = [child.as_dict() for child in self.children]
+		return d
+
+class NullSpan(object):
+	"""what span() returns while instrumentation is off"""
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+	def record(self, **counts):
+		pass
+
+NULL_SPAN = NullSpan()
+
+class Recorder(object):
+
+	def __init__(self, trace_memory=False, profile_dir=None, verbose=False):
+		self.trace_memory = trace_memory
+		self.profile_dir = profile_dir
+		self.verbose = verbose
+		self.root = Span('total')
+		self.stack = [self.root]
+		self.profiler = None		# at most one cProfile is active; spans inside a profiled one are not profiled apart
+		self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+		if self.started_tracing:
+			tracemalloc.start()
+
+	def close(self):
+		if self.started_tracing:
+			tracemalloc.stop()
+
+	def span(self, name, **counts):
+		return ActiveSpan(self, name, counts)
+
+	def enter(self, span):
+		self.stack[-1].children.append(span)
+		self.stack.append(span)
+		if self.trace_memory:
+			current, peak = tracemalloc.get_traced_memory()
+			self.stack[-2].peak_memory = max(self.stack[-2].peak_memory, peak)
+			tracemalloc.reset_peak()
+			span.start_memory = span.peak_memory = current
+		if self.profile_dir is not None and self.profiler is None:
+			self.profiler = (span, cProfile.Profile())
+			self.profiler[1].enable()
+		span.wall_start, span.cpu_start = time.perf_counter(), time.process_time()
+
+	def exit(self, span):
+		span.wall = time.perf_counter() - span.wall_start
+		span.cpu = time.process_time() - span.cpu_start
+		if self.profiler is not None and self.profiler[0] is span:
+			self.profiler[1].disable()
+			os.makedirs(self.profile_dir, exist_ok=True)
+			span.profile_path = os.path.join(self.profile_dir, '{}_{}.prof'.format(len(self.root.children), slug(span.name)))
+			self.profiler[1].dump_stats(span.profile_path)
+			self.profiler = None
+		if self.trace_memory:
+			span.peak_memory = max(span.peak_memory, tracemalloc.get_traced_memory()[1])
+			span.peak_mb = (span.peak_memory - span.start_memory) / 1e6
+			self.stack[-2].peak_memory = max(self.stack[-2].peak_memory, span.peak_memory)
+		self.stack.pop()
+		if self.verbose:
+			print(format_span(span, len(self.stack) - 1))
+
+class ActiveSpan(object):
+
+	def __init__(self, recorder, name, counts):
+		self.recorder = recorder
+		self.span = Span(name)
+		self.span.counts.update(counts)
+
+	def __enter__(self):
+		self.recorder.enter(self.span)
+		return self.span
+
+	def __exit__(self, *exc):
+		self.recorder.exit(self.span)
+		return False
+
+### MODULE-LEVEL RECORDER ###
+
+recorder = None
+
+def enable(trace_memory=False, profile_dir=None, verbose=False):
+	"""
+	starts a new report; trace_memory adds tracemalloc peaks, profile_dir a
+	cProfile dump of each outermost span, verbose a line per finished span
+	"""
+	global recorder
+	disable()
+	recorder = Recorder(trace_memory, profile_dir, verbose)
+
+def disable():
+	global recorder
+	if recorder is not None:
+		recorder.close()
+	recorder = None
+
+def span(name, **counts):
+	"""context manager timing a stage: with span('count 3-grams') as s: ... s.record(ngrams=k)"""
+	return recorder.span(name, **counts) if recorder is not None else NULL_SPAN
+
+def report():
+	"""the spans recorded since enable(), as nested dicts"""
+	if recorder is None:
+		return None
+	root = recorder.root
+	root.wall = sum(child.wall for child in root.children)
+	root.cpu = sum(child.cpu for child in root.children)
+	return root.as_dict()
+
+def write_report(path):
+	with open(path, 'w') as f:
+		json.dump(report(), f, indent=2)
+
+def format_report():
+	lines = []
+	def visit(span, depth):
+		lines.append(format_span(span, depth))
+		for child in span.children:
+			visit(child, depth + 1)
+	if recorder is not None:
+		for child in recorder.root.children:
+			visit(child, 0)
+	return '\n'.join(lines)
+
+def format_span(span, depth):
+	name = '  ' * depth + span.name
+	memory = '' if span.peak_mb is None else '{:>10.1f} MB'.format(span.peak_mb)
+	counts = ' '.join('{}={}'.format(k, v) for k, v in span.counts.items())
+	return '{:<40}{:>9.3f} s wall{:>9.3f} s cpu{}  {}'.format(name, span.wall, span.cpu, memory, counts).rstrip()
+
+def slug(name):
+	return ''.join(ch if ch.isalnum() else '_' for ch in name)
@@ -0,0 +1,38 @@
+"""
+A fixed-length list whose items are built on first access and then kept,
+for per-order artifacts (counts, stores, views, tables) of which a procedure
+usually reads only a few. Indexing, slicing and iteration build what they touch.
+"""
+
+NOT_BUILT = object()
+
+class LazyList(object):
+
+	def __init__(self, size, build, values=None):
+		"""build(i) makes item i; values optionally gives items already built"""
+		self.build = build
+		self.values = list(values) if values is not None else [NOT_BUILT] * size
+
+	def __len__(self):
+		return len(self.values)
+
+	def __getitem__(self, i):
+		if isinstance(i, slice):
+			return [self[j] for j in range(*i.indices(len(self)))]
+		if self.values[i] is NOT_BUILT:
+			self.values[i] = self.build(i % len(self))
+		return self.values[i]
+
+	def __setitem__(self, i, value):
+		self.values[i] = value
+
+	def __iter__(self):
+		for i in range(len(self)):
+			yield self[i]
+
+	def is_built(self, i):
+		return self.values[i] is not NOT_BUILT
+
+	def reset(self, i):
+		"""forget item i, so it is built again on the next access"""
+		self.values[i] = NOT_BUILT
@@ -1,18 +1,171 @@
 import pandas as pd
+import os
 import re
+import json
+import queue
+import shutil
+import hashlib
+import threading
+from multiprocessing import Pool
 from typing import List, Sequence
 
-def load_dataframe(truncate=2500):
-	df1 = pd.read_csv('data/ted_main.csv')
-	df2 = pd.read_csv('data/transcripts.csv')
-	df = pd.merge(left=df1, right=df2, how='left', left_on='url', right_on='url')
-	df = df.head(truncate)	# Optional: clip dataframe for testing
-	df['tags'] = df['tags'].apply(lambda x: set(eval(x)))
-	df['lines'] = df['transcript'].apply(lambda x: lines_from_text(x))
-	df['laugh_lines'] = df['lines'].apply(lambda x: get_laugh_lines(x))
-	df['applause_lines'] = df['lines'].apply(lambda x: get_applause_lines(x))
+from utilities.instrumentation import span
+from utilities import corpus_store
+from utilities.corpus_store import read_columnar_corpus, write_columnar_corpus, read_corpus_source, same_source
+
+TED_MAIN_PATH = 'data/ted_main.csv'
+TRANSCRIPTS_PATH = 'data/transcripts.csv'
+CORPUS_PATH = 'data/corpus'		# columnar copy of the cleaned CSVs, written by scripts/convert_corpus.py
+
+def load_dataframe(truncate=2500, num_workers=1, chunksize=32, columns=None):
+	"""
+	Reads the columnar corpus if it was converted from the current CSVs with the
+	current cleaning code, else parses and cleans the CSVs.
+	columns: load only these columns, e.g. ['lines', 'tags'] (default: all)
+	num_workers > 1 spreads tag parsing, cleaning and line splitting of the CSVs
+	across a process pool, in chunks of `chunksize` talks
+	"""
+	if os.path.exists(CORPUS_PATH):
+		with span('read corpus') as s:
+			df = read_columnar_corpus(CORPUS_PATH, columns, truncate, corpus_source())
+			s.record(documents=len(df) if df is not None else 0)
+		if df is not None:
+			return df
+		print('{} is out of date; reading the CSVs (rerun scripts/convert_corpus.py)'.format(CORPUS_PATH))
+	df = read_csv_dataframe(truncate, num_workers, chunksize)
+	return df[columns] if columns is not None else df
+
+def read_csv_dataframe(truncate=2500, num_workers=1, chunksize=32):
+	with span('read csv') as s:
+		df1 = pd.read_csv(TED_MAIN_PATH)
+		df2 = pd.read_csv(TRANSCRIPTS_PATH)
+		df = pd.merge(left=df1, right=df2, how='left', left_on='url', right_on='url')
+		df = df.head(truncate).copy() if truncate is not None else df	# Optional: clip dataframe for testing
+		s.record(documents=len(df))
+	rows = list(zip(df['tags'], df['transcript']))
+	with span('clean transcripts', workers=num_workers):
+		if num_workers > 1:
+			chunks = [rows[i:i+chunksize] for i in range(0, len(rows), chunksize)]
+			with Pool(num_workers) as pool:
+				ingested = flatten_list(pool.map(ingest_rows, chunks))
+		else:
+			ingested = ingest_rows(rows)
+	for i, column in enumerate(['tags', 'lines', 'laugh_lines', 'applause_lines']):
+		df[column] = pd.Series([row[i] for row in ingested], index=df.index, dtype=object)
 	return df
 
+def stream_talks(truncate=None, chunksize=64, max_queued_chunks=4, tokens_only=False):
+	"""
+	Yields one cleaned record per talk without holding the corpus in memory.
+	tokens_only: records hold each line's lowercase tokens (tokens_from_text) in
+	place of its text and the event lines, which is all a model needs.
+	A reader thread pulls `chunksize` rows of transcripts.csv at a time into a
+	queue of at most `max_queued_chunks` chunks; each talk is joined to its
+	ted_main.csv metadata on url and cleaned as it is consumed.
+	Talks come in transcripts.csv order and only talks with both a transcript and
+	metadata are yielded, unlike load_dataframe, which left-joins in ted_main.csv
+	order and keeps talks without a transcript as empty documents. The two give
+	the same talks in the same order only when both CSVs list the same urls in the
+	same order; a left join in ted_main.csv order would have to read all of
+	transcripts.csv before yielding a talk it lacks, so stream_talks does not.
+	"""
+	metadata = pd.read_csv(TED_MAIN_PATH, usecols=['url', 'title', 'tags'])
+	metadata = {url: (title, tags) for url, title, tags in zip(metadata['url'], metadata['title'], metadata['tags'])}
+	chunks = queue.Queue(maxsize=max_queued_chunks)
+	stop = threading.Event()
+
+	def read_chunks():
+		try:
+			for chunk in pd.read_csv(TRANSCRIPTS_PATH, chunksize=chunksize):
+				if not put_unless_stopped(chunks, list(zip(chunk['url'], chunk['transcript'])), stop):
+					return
+			put_unless_stopped(chunks, None, stop)
+		except Exception as e:
+			put_unless_stopped(chunks, e, stop)
+
+	reader = threading.Thread(target=read_chunks, daemon=True)
+	reader.start()
+	yielded = 0
+	try:
+		while truncate is None or yielded < truncate:
+			chunk = chunks.get()
+			if chunk is None:
+				return
+			if isinstance(chunk, Exception):
+				raise chunk
+			for url, transcript in chunk:
+				if url not in metadata or (truncate is not None and yielded >= truncate):
+					continue
+				title, tags = metadata[url]
+				if tokens_only:
+					yield {'url': url, 'title': title, 'tags': set(eval(tags)), 'tokens': tokens_from_text(transcript)}
+				else:
+					__, lines, laugh_lines, applause_lines = ingest_rows([(tags, transcript)])[0]
+					yield {'url': url, 'title': title, 'tags': set(eval(tags)), 'lines': lines,
+							'laugh_lines': laugh_lines, 'applause_lines': applause_lines}
+				yielded += 1
+	finally:
+		stop.set()
+
+def put_unless_stopped(q, item, stop):
+	"""blocking put that gives up once the consumer has stopped"""
+	while not stop.is_set():
+		try:
+			q.put(item, timeout=0.1)
+			return True
+		except queue.Full:
+			pass
+	return False
+
+def ingest_rows(rows):
+	"""rows: [(tags string, transcript)] -> [(tags, lines, laugh_lines, applause_lines)]"""
+	ingested = []
+	for tags, transcript in rows:
+		lines = lines_from_text(transcript)
+		ingested.append((set(eval(tags)), lines, get_laugh_lines(lines), get_applause_lines(lines)))
+	return ingested
+
+def corpus_fingerprint():
+	"""
+	key of the corpus and of the code that cleans and tokenizes it, for model
+	snapshots: corpus_source() plus a hash of ngram_utils. Where a CSV is absent,
+	the columnar corpus's record of it is used instead, so neither case reads the CSVs.
+	"""
+	from utilities import ngram_utils
+	source = corpus_source()
+	if None in source['files'].values():
+		stored = read_corpus_source(CORPUS_PATH)
+		if stored is not None and same_source(stored, source):
+			source = stored
+	return hashlib.sha1((json.dumps(source, sort_keys=True) + code_hash(ngram_utils.__file__)).encode('utf-8')).hexdigest()
+
+def corpus_source():
+	"""
+	what the columnar corpus is checked against: size and modification time of each
+	CSV (None where the CSV is absent, so a corpus can stand in for it) and a hash
+	of this file and of corpus_store, which hold the cleaning and storing code
+	"""
+	files = {}
+	for path in [TED_MAIN_PATH, TRANSCRIPTS_PATH]:
+		files[os.path.basename(path)] = [os.path.getsize(path), os.path.getmtime(path)] if os.path.exists(path) else None
+	return {'files': files, 'code': code_hash(__file__, corpus_store.__file__)}
+
+def code_hash(*paths):
+	digest = hashlib.sha1()
+	for path in paths:
+		with open(path, 'rb') as f:
+			digest.update(f.read())
+	return digest.hexdigest()
+
+def convert_corpus(path=None, num_workers=1):
+	"""(re)writes the columnar corpus from the CSVs; returns the number of talks"""
+	path = path or CORPUS_PATH
+	df = read_csv_dataframe(truncate=None, num_workers=num_workers)
+	if os.path.exists(path):
+		shutil.rmtree(path)
+	write_columnar_corpus(path, df, corpus_source())
+	return len(df)
+
 # LINE OPERATIONS
 
 def get_laugh_lines(lines: List[str]):
@@ -22,7 +175,7 @@ def get_applause_lines(lines: List[str]):
 	return [start for start, end in zip(lines[:-1], lines[1:]) if end == '<Applause>']
 
 def lines_for_tag(df, tag):
-	return df.loc[tag in df['tags']]
+	return flatten_list(df['lines'][df['tags'].apply(lambda tags: tag in tags)])
 
 def flatten_list(list_of_lists):
 	return [item for sublist in list_of_lists for item in sublist]
@@ -30,18 +183,30 @@ def flatten_list(list_of_lists):
 # TEXT CLEANING
 
 exclude_set = set(['♫','♪'])	# exclude lines with any of these tokens
+EXCLUDE_PATTERN = re.compile('[' + ''.join(sorted(exclude_set)) + ']')
+
+# one scan for parentheticals: (Applause) and (Laughter) become event lines, any other
+# (...) on one line is dropped; an event inside another parenthetical goes with it
+EVENT_NAMES = r'(?:Applause|Laughter)'
+PARENTHETICAL_PATTERN = re.compile(r'\((' + EVENT_NAMES + r')\)|\((?:\(' + EVENT_NAMES + r'\)|(?!\(' + EVENT_NAMES + r'\))[^)\n])*\)')
 
 def lines_from_text(text):
 	if not isinstance(text, str): 	# catch nan values
 		return []
-	lines = clean(text).split('. ')
-	return [line.strip() for line in lines if len(line) > 0 and not any_in_line(line, exclude_set)]
+	return [line.strip() for line in split_lines(clean(text))]
 
-def any_in_line(line, exclude_set):
-	for ch in line:
-		if ch in exclude_set:
-			return True
-	return False
+def tokens_from_text(text):
+	"""each line of lines_from_text(text) as a list of lowercase tokens, as ngrams_for_line and encode_lines split them"""
+	if not isinstance(text, str):
+		return []
+	return [line.split() for line in split_lines(clean(text).lower())]
+
+def split_lines(text):
+	"""the non-empty sentences of cleaned text, minus those with excluded characters; most texts have none to check for"""
+	lines = text.split('. ')
+	if EXCLUDE_PATTERN.search(text) is None:
+		return [line for line in lines if line]
+	return [line for line in lines if line and not EXCLUDE_PATTERN.search(line)]
 
 def clean(text: str):
 	text = text.replace(',', '')
@@ -58,9 +223,10 @@ def clean_transcript(transcript):
 	return '\n'.join(lines_from_text(transcript))
 
 def handle_parentheticals(text: str):
-	text = text.replace("(Applause)", ". <Applause>. ")
-	text = text.replace("(Laughter)", ". <Laughter>. ")
-	return re.sub(r'\(.*?\)', '', text)		# remove all other parentheticals
+	return PARENTHETICAL_PATTERN.sub(replace_parenthetical, text)
+
+def replace_parenthetical(match):
+	return '. <{}>. '.format(match.group(1)) if match.group(1) else ''
 
 def get_tags(fpath):
 	"""fpath: path to a tab delimited file of common tags and their counts"""
@@ -1,5 +1,9 @@
-import math
+from array import array
 from collections import Counter
+
+import numpy as np
+
+from utilities.vocabulary import Vocabulary
 from utilities.dictionary import (
 	sum_counters,
 	enter_nested_item,
@@ -12,7 +16,7 @@ def ngrams_for_sequence(tokens, n):
 	return [' '.join(tokens[start:start+n]) for start in range(len(tokens) + 1 - n)]
 
 def split_ngrams_for_sequence(tokens, n):
-	return [tokens[start:start+n] for start in range(len(tokens) - n)]
+	return [tokens[start:start+n] for start in range(len(tokens) + 1 - n)]
 
 def ngrams_for_line(line, n):
 	words = line.lower().split()
@@ -24,6 +28,169 @@ def ngram_counts_for_line(line, n):
 def ngram_counts_for_lines(lines, n):
 	return sum_counters([ngram_counts_for_line(line, n) for line in lines])
 
+### GET NGRAMS AS TOKEN IDS ###
+
+KEY_DTYPE = np.dtype('>u4')		# big-endian, so bytewise order matches id order
+
+def row_keys(rows):
+	"""one opaque, bytewise-comparable key per row of token ids"""
+	rows = np.ascontiguousarray(rows, dtype=KEY_DTYPE)
+	return rows.view(np.dtype((np.void, rows.shape[1] * KEY_DTYPE.itemsize))).ravel()
+
+def rows_from_keys(keys, n):
+	return keys.view(KEY_DTYPE).reshape(-1, n)
+
+def encode_lines(lines, vocab):
+	"""
+	Tokenizes every line once into a flat stream of token ids.
+	Line i spans stream[line_bounds[i]:line_bounds[i+1]]. A line may also come
+	already split into lowercase tokens, e.g. by librarian.tokens_from_text.
+	"""
+	stream = array('i')
+	line_bounds = array('q', [0])
+	for line in lines:
+		stream.extend(vocab.encode(line if isinstance(line, list) else line.lower().split()))
+		line_bounds.append(len(stream))
+	return np.frombuffer(stream, dtype=np.int32), np.frombuffer(line_bounds, dtype=np.int64)
+
+def encode_documents(lines_by_doc, vocab):
+	"""
+	encode_lines over all documents, plus doc_bounds: document d spans lines
+	doc_bounds[d]:doc_bounds[d+1]. lines_by_doc may be a one-shot iterable,
+	e.g. a generator of talks still being read.
+	"""
+	doc_bounds = array('q', [0])
+	def lines():
+		for doc_lines in lines_by_doc:
+			yield from doc_lines
+			doc_bounds.append(doc_bounds[-1] + len(doc_lines))
+	stream, line_bounds = encode_lines(lines(), vocab)
+	return stream, line_bounds, np.frombuffer(doc_bounds, dtype=np.int64)
+
+def count_windows(line_bounds, n):
+	"""number of n-token windows that stay within one line"""
+	return int(np.maximum(np.diff(line_bounds) - n + 1, 0).sum())
+
+def window_starts(line_bounds, n):
+	"""stream positions of every n-token window that stays within one line"""
+	windows_per_line = np.maximum(np.diff(line_bounds) - n + 1, 0)
+	first_window = np.cumsum(windows_per_line) - windows_per_line
+	offsets = np.arange(windows_per_line.sum()) - np.repeat(first_window, windows_per_line)
+	return np.repeat(line_bounds[:-1], windows_per_line) + offsets
+
+def ngram_id_rows(stream, starts, n):
+	"""(len(starts), n) array of the token ids in each window"""
+	return stream[starts[:, None] + np.arange(n)]
+
+### COUNT ALL ORDERS ###
+
+class OrderCounts(object):
+	"""
+	Counts for one ngram order over a corpus of documents.
+	rows: sorted distinct (k, n) token ids
+	counts, doc_freqs: (k,) corpus counts and document frequencies
+	tf_indptr, tf_indices, tf_values: term frequencies as a compressed sparse row
+		matrix, documents by rows; document d's ngrams are
+		rows[tf_indices[tf_indptr[d]:tf_indptr[d+1]]]
+	"""
+
+	def __init__(self, rows, counts, doc_freqs, tf_indptr, tf_indices, tf_values):
+		self.rows = rows
+		self.counts = counts
+		self.doc_freqs = doc_freqs
+		self.tf_indptr = tf_indptr
+		self.tf_indices = tf_indices
+		self.tf_values = tf_values
+
+def count_ngram_order(stream, line_bounds, doc_bounds, n):
+	"""
+	Corpus counts, per-document term frequencies and document frequencies
+	of the n-grams of one encoded token stream.
+	"""
+	num_docs = len(doc_bounds) - 1
+	starts = window_starts(line_bounds, n)
+	doc_rows = np.column_stack([window_docs(line_bounds, doc_bounds, starts), ngram_id_rows(stream, starts, n)])
+	pair_keys, tf_values = np.unique(row_keys(doc_rows), return_counts=True)
+	return order_counts_from_pairs(rows_from_keys(pair_keys, n+1), tf_values, num_docs)
+
+def window_docs(line_bounds, doc_bounds, starts):
+	"""document index of the window starting at each position"""
+	line_docs = np.repeat(np.arange(len(doc_bounds) - 1), np.diff(doc_bounds))
+	return line_docs[np.searchsorted(line_bounds, starts, side='right') - 1]
+
+def order_counts_from_pairs(pairs, tf_values, num_docs):
+	"""
+	OrderCounts from sorted, distinct (document, ngram ids...) rows and the
+	number of times each ngram occurs in each document
+	"""
+	n = pairs.shape[1] - 1
+	keys, tf_indices, doc_freqs = np.unique(row_keys(pairs[:, 1:]), return_inverse=True, return_counts=True)
+	counts = np.bincount(tf_indices, weights=tf_values, minlength=len(keys)).astype(np.int64)
+	tf_indptr = np.searchsorted(pairs[:, 0], np.arange(num_docs+1))
+	return OrderCounts(rows_from_keys(keys, n), counts, doc_freqs.astype(np.int64),
+						tf_indptr, tf_indices.ravel(), tf_values.astype(np.int64))
+
+def merge_order_counts(a, b):
+	"""OrderCounts of two corpora together, numbering b's documents after a's"""
+	n = a.rows.shape[1]
+	keys, inverse = np.unique(np.concatenate([row_keys(a.rows), row_keys(b.rows)]), return_inverse=True)
+	inverse = inverse.ravel()
+	remap_a, remap_b = inverse[:len(a.rows)], inverse[len(a.rows):]	# both increasing, so rows stay sorted
+	counts = np.bincount(inverse, weights=np.concatenate([a.counts, b.counts]), minlength=len(keys))
+	doc_freqs = np.bincount(inverse, weights=np.concatenate([a.doc_freqs, b.doc_freqs]), minlength=len(keys))
+	return OrderCounts(rows_from_keys(keys, n), counts.astype(np.int64), doc_freqs.astype(np.int64),
+						np.concatenate([a.tf_indptr, b.tf_indptr[1:] + a.tf_indptr[-1]]),
+						np.concatenate([remap_a[a.tf_indices], remap_b[b.tf_indices]]),
+						np.concatenate([a.tf_values, b.tf_values]))
+
+def select_documents(order, keep_docs):
+	"""OrderCounts of only the documents where keep_docs is True, dropping ngrams left with no occurrences"""
+	keep_entries = np.repeat(keep_docs, np.diff(order.tf_indptr))
+	indices, tf_values = order.tf_indices[keep_entries], order.tf_values[keep_entries]
+	counts = np.bincount(indices, weights=tf_values, minlength=len(order.rows)).astype(np.int64)
+	doc_freqs = np.bincount(indices, minlength=len(order.rows)).astype(np.int64)
+	alive = counts > 0
+	remap = np.cumsum(alive) - 1
+	tf_indptr = np.concatenate([[0], np.cumsum(np.diff(order.tf_indptr)[keep_docs])])
+	return OrderCounts(order.rows[alive], counts[alive], doc_freqs[alive], tf_indptr, remap[indices], tf_values)
+
+### SHARDED COUNTING ###
+
+def count_shard(lines_by_doc, sizes):
+	"""
+	Encodes one shard of documents with its own vocabulary and counts the given
+	orders. Returns (vocabulary tokens, stream, line_bounds, doc_bounds, OrderCounts by size).
+	"""
+	vocab = Vocabulary()
+	stream, line_bounds, doc_bounds = encode_documents(lines_by_doc, vocab)
+	return vocab.tokens, stream, line_bounds, doc_bounds, [count_ngram_order(stream, line_bounds, doc_bounds, n) for n in sizes]
+
+def remap_order_counts(order, id_map):
+	"""the same counts with token i renamed id_map[i], rows and each document's entries re-sorted"""
+	n = order.rows.shape[1]
+	keys = row_keys(id_map[order.rows])
+	perm = np.argsort(keys, kind='stable')
+	rank = np.empty_like(perm)
+	rank[perm] = np.arange(len(perm))
+	indices = rank[order.tf_indices]
+	entry_docs = np.repeat(np.arange(len(order.tf_indptr) - 1), np.diff(order.tf_indptr))
+	entries = np.lexsort((indices, entry_docs))
+	return OrderCounts(rows_from_keys(keys[perm], n), order.counts[perm], order.doc_freqs[perm],
+						order.tf_indptr, indices[entries], order.tf_values[entries])
+
+def remap_order_count_list(orders, id_map):
+	return [remap_order_counts(order, id_map) for order in orders]
+
+def merge_order_count_lists(a, b):
+	return [merge_order_counts(x, y) for x, y in zip(a, b)]
+
+def tree_reduce(pool, parts, merge):
+	"""merges neighbouring parts pairwise on the pool, level by level, keeping their order"""
+	while len(parts) > 1:
+		merged = pool.starmap(merge, zip(parts[0::2], parts[1::2]))
+		parts = merged + parts[-1:] if len(parts) % 2 else merged
+	return parts[0]
+
 ### BUILD MODELS ###
 
 def model_from_counts(ngram_counts, n):
@@ -40,13 +207,68 @@ def build_ngram_model(lines, n):
 
 ### TFIDF ###
 
+class TfidfMatrix(object):
+	"""
+	Documents x ngrams TF-IDF in compressed sparse row form, built from the term
+	frequencies of an OrderCounts. Columns whose document frequency is below
+	min_doc_freq_threshold are masked out of the matrix.
+	"""
+
+	def __init__(self, counts, min_doc_freq_threshold=1):
+		self.num_docs = len(counts.tf_indptr) - 1
+		self.idf = -np.log(counts.doc_freqs / self.num_docs)
+		self.column_mask = counts.doc_freqs >= min_doc_freq_threshold
+		keep = self.column_mask[counts.tf_indices]
+		self.indptr = np.concatenate([[0], np.cumsum(keep)])[counts.tf_indptr]
+		self.indices = counts.tf_indices[keep]
+		self.tfs = counts.tf_values[keep]
+		self.data = self.tfs * self.idf[self.indices]
+		self.entry_docs = np.repeat(np.arange(self.num_docs), np.diff(self.indptr))
+		self.row_norms = np.sqrt(np.bincount(self.entry_docs, weights=self.data**2, minlength=self.num_docs))
+
+	@classmethod
+	def from_arrays(cls, idf, column_mask, indptr, indices, tfs, data, entry_docs, row_norms):
+		"""a matrix over arrays computed before, e.g. read from a snapshot or shared memory"""
+		matrix = cls.__new__(cls)
+		matrix.num_docs = len(indptr) - 1
+		matrix.idf, matrix.column_mask, matrix.indptr, matrix.indices = idf, column_mask, indptr, indices
+		matrix.tfs, matrix.data, matrix.entry_docs, matrix.row_norms = tfs, data, entry_docs, row_norms
+		return matrix
+
+	def row(self, d):
+		"""(column indices, tfidf values) of document d"""
+		lo, hi = self.indptr[d], self.indptr[d+1]
+		return self.indices[lo:hi], self.data[lo:hi]
+
+	def top_k(self, k):
+		"""
+		The k highest scoring columns of every document at once, in descending order,
+		as CSR arrays (indptr, indices, values)
+		"""
+		order = np.lexsort((-self.data, self.entry_docs))
+		rank = np.arange(len(order)) - self.indptr[self.entry_docs[order]]
+		top = order[rank < k]
+		indptr = np.concatenate([[0], np.cumsum(np.minimum(np.diff(self.indptr), k))])
+		return indptr, self.indices[top], self.data[top]
+
 def tf_idf(lines_by_doc, ngram_size, min_doc_freq_threshold=1):
-	total_docs = len(lines_by_doc)
-	term_frequencies = list(map(lambda x: ngram_counts_for_lines(x, ngram_size), lines_by_doc))
-	doc_frequencies = sum_counters([{k: 1 for k in counter} for counter in term_frequencies])
-	tfidfs = list(map(lambda x:
-		{k: tf * -math.log(doc_frequencies[k]/total_docs)
-		for k, tf in x.items()
-		if doc_frequencies[k] >= min_doc_freq_threshold}, term_frequencies)
-		)
-	return term_frequencies, doc_frequencies, tfidfs
\ No newline at end of file
+	vocab = Vocabulary()
+	counts = count_ngram_order(*encode_documents(lines_by_doc, vocab), ngram_size)
+	matrix = TfidfMatrix(counts, min_doc_freq_threshold)
+	keys = [' '.join(vocab.decode(row)) for row in counts.rows.tolist()]
+	term_frequencies = sparse_rows_as_dicts(keys, counts.tf_indptr, counts.tf_indices, counts.tf_values)
+	doc_frequencies = dict(zip(keys, counts.doc_freqs.tolist()))
+	tfidfs = sparse_rows_as_dicts(keys, matrix.indptr, matrix.indices, matrix.data)
+	return term_frequencies, doc_frequencies, tfidfs
+
+def top_tfidf_ngrams(lines_by_doc, ngram_size, k, min_doc_freq_threshold=1):
+	"""the k ngrams with the highest tf-idf in each document, computed for all documents together"""
+	vocab = Vocabulary()
+	counts = count_ngram_order(*encode_documents(lines_by_doc, vocab), ngram_size)
+	indptr, indices, values = TfidfMatrix(counts, min_doc_freq_threshold).top_k(k)
+	keys = [' '.join(vocab.decode(row)) for row in counts.rows.tolist()]
+	return [[keys[i] for i in indices[lo:hi].tolist()] for lo, hi in zip(indptr[:-1], indptr[1:])]
+
+def sparse_rows_as_dicts(keys, indptr, indices, values):
+	return [dict(zip([keys[i] for i in indices[lo:hi].tolist()], values[lo:hi].tolist()))
+			for lo, hi in zip(indptr[:-1], indptr[1:])]
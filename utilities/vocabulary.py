@@ -0,0 +1,34 @@
+class Vocabulary(object):
+	"""Maps tokens to contiguous integer ids, in order of first appearance."""
+
+	def __init__(self, tokens=()):
+		self.token_ids = {}
+		self.tokens = []
+		for token in tokens:
+			self.add(token)
+
+	def __len__(self):
+		return len(self.tokens)
+
+	def __contains__(self, token):
+		return token in self.token_ids
+
+	def add(self, token):
+		if token not in self.token_ids:
+			self.token_ids[token] = len(self.tokens)
+			self.tokens.append(token)
+		return self.token_ids[token]
+
+	def encode(self, tokens):
+		"""ids for tokens, adding unseen tokens to the vocabulary"""
+		return [self.add(token) for token in tokens]
+
+	def lookup(self, tokens):
+		"""ids for tokens, or None if any token is out of vocabulary"""
+		try:
+			return [self.token_ids[token] for token in tokens]
+		except KeyError:
+			return None
+
+	def decode(self, ids):
+		return [self.tokens[i] for i in ids]